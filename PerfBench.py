@@ -0,0 +1,575 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2  # pip install opencv-python
+import numpy as np  # pip install numpy
+
+import PerfGarden as pg
+
+
+# ========== 合成数据：模板在已知帧出现、消失，带加载动画与噪声 ==========
+def _draw_button(img):
+    """在图片底部绘制按钮（cattail 检测目标），位置按分辨率比例计算"""
+    h, w = img.shape[:2]
+    x0, y0 = int(w * 0.28), int(h * 0.84)
+    x1, y1 = int(w * 0.72), int(h * 0.94)
+    cv2.rectangle(img, (x0, y0), (x1, y1), (40, 120, 220), -1)
+    scale = w / 300
+    cv2.putText(
+        img,
+        "OK",
+        (x0 + (x1 - x0) // 3, y1 - (y1 - y0) // 4),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        scale,
+        (255, 255, 255),
+        max(1, int(scale * 2.5)),
+    )
+    return (x0 - 10, y0 - 10, x1 + 10, y1 + 10)
+
+
+def _draw_frame(width, height, index, truth, rng):
+    """
+    绘制单帧合成图片
+
+    参数:
+        width, height: 分辨率
+        index: 帧序号
+        truth: 关键帧序号字典（appear、fade、bubble、circle_on、circle_off）
+        rng: 随机数生成器（噪声）
+
+    返回:
+        BGR 图片数组
+    """
+    img = np.full((height, width, 3), 235, np.uint8)
+    scale = width / 300
+    cv2.putText(
+        img,
+        "Title",
+        (int(width * 0.06), int(height * 0.08)),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        scale,
+        (30, 30, 30),
+        max(1, int(scale * 2)),
+    )
+
+    # 加载动画：顶部小范围旋转圆弧，每帧变化（cactus 应容忍）
+    center = (int(width * 0.85), int(height * 0.06))
+    radius = max(4, int(width * 0.03))
+    angle = (index * 30) % 360
+    cv2.ellipse(img, center, (radius, radius), angle, 0, 270, (90, 90, 90), 2)
+
+    if truth["appear"] <= index < truth["fade"]:
+        _draw_button(img)
+
+    # 文字气泡：大面积区域瞬间出现（cactus 检测目标）
+    if index >= truth["bubble"]:
+        cv2.rectangle(
+            img,
+            (int(width * 0.05), int(height * 0.15)),
+            (int(width * 0.95), int(height * 0.45)),
+            (200, 200, 200),
+            -1,
+        )
+
+    # 圆圈：半径固定 22 像素（blover 参数按像素设定）
+    if truth["circle_on"] <= index < truth["circle_off"]:
+        cv2.circle(img, (width // 2, int(height * 0.6)), 22, (80, 80, 80), 3)
+
+    noise = rng.integers(0, 2, img.shape, dtype=np.uint8)
+    return cv2.add(img, noise)
+
+
+def generate_dataset(root, resolution, folders=4, frames=120, seed=0):
+    """
+    生成合成数据集：总文件夹内若干子文件夹，每个子文件夹的关键帧位置不同
+
+    参数:
+        root: 输出目录
+        resolution: (宽, 高)
+        folders: 子文件夹数量
+        frames: 每个子文件夹的帧数
+        seed: 随机种子，相同参数生成完全相同的数据
+
+    返回:
+        字典 {"parent", "template", "truth": {子文件夹名: 关键帧序号字典}}
+    """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    parent = os.path.join(root, f"{width}x{height}", "parent")
+    os.makedirs(parent, exist_ok=True)
+
+    truth = {}
+    for k in range(folders):
+        appear = int(rng.integers(frames // 10, frames // 4))
+        fade = appear + int(rng.integers(frames // 8, frames // 4))
+        bubble = fade + int(rng.integers(frames // 16, frames // 8))
+        circle_on = bubble + int(rng.integers(1, frames // 16))
+        circle_off = min(frames, circle_on + frames // 8)
+        name = f"run{k + 1}"
+        truth[name] = {
+            "appear": appear,
+            "fade": fade,
+            "bubble": bubble,
+            "circle_on": circle_on,
+            "circle_off": circle_off,
+        }
+        folder = os.path.join(parent, name)
+        os.makedirs(folder, exist_ok=True)
+        for i in range(frames):
+            img = _draw_frame(width, height, i, truth[name], rng)
+            cv2.imwrite(
+                os.path.join(folder, f"frame_{i:05d}.jpg"),
+                img,
+                [cv2.IMWRITE_JPEG_QUALITY, 90],
+            )
+
+    # 模板：从无噪声的按钮帧中裁剪
+    img = np.full((height, width, 3), 235, np.uint8)
+    x0, y0, x1, y1 = _draw_button(img)
+    template = os.path.join(root, f"{width}x{height}", "button.jpg")
+    cv2.imwrite(template, img[y0:y1, x0:x1])
+
+    return {"parent": parent, "template": template, "truth": truth}
+
+
+def _frame_name(index):
+    return f"frame_{index:05d}.jpg"
+
+
+def _image_files(folder):
+    return sorted(f for f in os.listdir(folder) if f.endswith(".jpg"))
+
+
+# ========== 基准测试 ==========
+def bench_detectors(dataset, repeat=3):
+    """
+    测量各检测器单帧耗时（含解码，不使用帧缓存）
+
+    返回:
+        结果列表，每项含 detector、frames、ms_mean、ms_median
+    """
+    folder = os.path.join(dataset["parent"], "run1")
+    paths = [os.path.join(folder, f) for f in _image_files(folder)]
+    template = dataset["template"]
+
+    cases = {
+        "decode_gray": lambda p: pg._decode_gray(p, "gray"),
+        "cattail": lambda p: pg.cattail(p, template, crop=30),
+        "cattail_pyramid2": lambda p: pg.cattail(
+            p, template, crop=30, pyramid_levels=2
+        ),
+        "cactus": lambda p: pg.cactus(p, paths[0]),
+        "cactus_scale4": lambda p: pg.cactus(p, paths[0], decode_scale=4),
+        "blover": lambda p: pg.blover(p),
+        "blover_scale2": lambda p: pg.blover(p, decode_scale=2),
+    }
+
+    results = []
+    for name, func in cases.items():
+        func(paths[0])  # 预热（模板缓存、OpenCV 初始化）
+        samples = []
+        for _ in range(repeat):
+            for path in paths:
+                start = time.perf_counter()
+                func(path)
+                samples.append((time.perf_counter() - start) * 1000)
+        results.append(
+            {
+                "detector": name,
+                "frames": len(samples),
+                "ms_mean": round(statistics.fmean(samples), 4),
+                "ms_median": round(statistics.median(samples), 4),
+            }
+        )
+    return results
+
+
+# 搜索基准任务：(名称, 检测函数, trails 参数, 起始关键帧, 期望结果对应的关键帧)
+# 与 bench_scaling 的任务流水线一致：cactus 从按钮消失的帧开始，以该帧为模板
+TRAILS_CASES = (
+    ("cattail_appear", pg.cattail, {"crop": 30}, None, "appear"),
+    ("cattail_fade", pg.cattail, {"crop": 30, "fade": True}, "appear", "fade"),
+    ("cactus_bubble", pg.cactus, {}, "fade", "bubble"),
+)
+
+
+# 金字塔匹配一致性检查：(裁剪, 金字塔层数) 组合，逐帧与全图匹配对比
+PYRAMID_CASES = tuple((crop, levels) for crop in (30, 0, -60) for levels in (1, 2, 3))
+
+
+def check_pyramid(dataset, threshold=0.9, tolerance=0.1):
+    """
+    检查 cattail 金字塔匹配与全图匹配的结果是否一致：逐帧比较是否匹配（PASS/FAIL
+    判定）必须完全相同，置信度之差不得超过 tolerance（粗匹配可能错过远离候选位置的
+    局部最大值，未匹配帧的置信度可能略低）
+
+    返回:
+        结果列表，每项含 crop、levels、frames、verdict_mismatches、
+        confidence_diffs（置信度不同的帧数）、max_confidence_diff、ok
+    """
+    template = dataset["template"]
+    paths = []
+    for name in dataset["truth"]:
+        folder = os.path.join(dataset["parent"], name)
+        paths += [os.path.join(folder, f) for f in _image_files(folder)]
+
+    results = []
+    for crop, levels in PYRAMID_CASES:
+        mismatches, diffs, max_diff = 0, 0, 0.0
+        for path in paths:
+            exhaustive = pg.cattail(path, template, threshold, crop=crop)
+            pyramid = pg.cattail(
+                path, template, threshold, crop=crop, pyramid_levels=levels
+            )
+            mismatches += exhaustive[1] != pyramid[1]
+            diff = round(abs(exhaustive[2] - pyramid[2]), 2)
+            diffs += diff > 0
+            max_diff = max(max_diff, diff)
+        results.append(
+            {
+                "crop": crop,
+                "levels": levels,
+                "frames": len(paths),
+                "verdict_mismatches": mismatches,
+                "confidence_diffs": diffs,
+                "max_confidence_diff": max_diff,
+                "ok": mismatches == 0 and max_diff <= tolerance,
+            }
+        )
+    return results
+
+
+def bench_trails(dataset, leaps=(1, 2, 3, 5, 8), searches=("leap", "bisect")):
+    """
+    测量 trails 在不同 leap 与搜索策略下的检测帧数与耗时，并校验结果是否等于真实关键帧
+
+    返回:
+        结果列表，每项含 task、search、leap、evaluated、wall_s、correct
+    """
+    results = []
+    for task, func, kwargs, start_key, key in TRAILS_CASES:
+        template = dataset["template"] if func is pg.cattail else None
+        for search in searches:
+            for leap in leaps:
+                evaluated = 0
+                wall = 0.0
+                correct = 0
+                for name, truth in dataset["truth"].items():
+                    folder = os.path.join(dataset["parent"], name)
+                    image_files = _image_files(folder)
+                    if start_key is not None:
+                        image_files = image_files[truth[start_key] :]
+                    stats = {"evaluated": 0}
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        status, matched, _ = pg.trails(
+                            image_files,
+                            folder,
+                            template_path=template,
+                            detector_func=func,
+                            leap=leap,
+                            search=search,
+                            stats=stats,
+                            **kwargs,
+                        )
+                    wall += time.perf_counter() - start
+                    evaluated += stats["evaluated"]
+                    correct += status == "PASS" and matched == _frame_name(truth[key])
+                results.append(
+                    {
+                        "task": task,
+                        "search": search,
+                        "leap": leap,
+                        "evaluated": evaluated,
+                        "wall_s": round(wall, 4),
+                        "correct": correct,
+                        "folders": len(dataset["truth"]),
+                    }
+                )
+    return results
+
+
+def bench_scaling(dataset, threads=(1, 2, 4), executor="thread"):
+    """
+    测量 gate_multi_thread 在不同线程数下处理整个数据集的耗时
+
+    子文件夹数应明显多于最大线程数，否则线程数增加后无法体现扩展效果。
+    加速比低于 1（比第一个线程数更慢）或线程数超过 CPU 核数的结果会被标记，
+    此时扩展结果不能说明并行效果。
+
+    返回:
+        结果列表，每项含 threads、wall_s、speedup（相对第一个线程数）、
+        slower（加速比低于 1）、oversubscribed（线程数超过 CPU 核数）
+    """
+    tasks = [
+        {"task_type": "cattail", "template_path": dataset["template"], "crop": 30},
+        {
+            "task_type": "cattail",
+            "template_path": dataset["template"],
+            "crop": 30,
+            "fade": True,
+        },
+        {"task_type": "cactus"},
+    ]
+    for task_kwargs in tasks:
+        task_kwargs["detector"] = pg.compile_task(task_kwargs)
+    headers = ["cattail1", "cattail2", "cactus1"]
+    options = {"executor": executor, "result_cache": False}
+    csv_filename = os.path.join(dataset["parent"], "处理结果.csv")
+
+    results = []
+    for count in threads:
+        if os.path.exists(csv_filename):
+            os.remove(csv_filename)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pg.gate_multi_thread(
+                dataset["parent"], tasks, headers, count, False, options
+            )
+        wall = time.perf_counter() - start
+        results.append({"threads": count, "wall_s": round(wall, 4)})
+
+    base = results[0]["wall_s"] if results else 0
+    cpu_count = os.cpu_count() or 1
+    for result in results:
+        result["speedup"] = round(base / result["wall_s"], 2) if result["wall_s"] else 0
+        result["slower"] = result["speedup"] < 1
+        result["oversubscribed"] = result["threads"] > cpu_count
+        if result["slower"]:
+            print(
+                f"🟠 【警告】{result['threads']} 线程比 {results[0]['threads']} 线程更慢（加速比 {result['speedup']}，CPU 核数 {cpu_count}），扩展结果无效"
+            )
+        elif result["oversubscribed"]:
+            print(
+                f"🟠 【警告】{result['threads']} 线程超过 CPU 核数 {cpu_count}，加速比不代表并行效果"
+            )
+    return results
+
+
+def run_benchmarks(
+    resolutions,
+    folders,
+    frames,
+    seed,
+    repeat,
+    threads,
+    executor,
+    workdir=None,
+    scaling_folders=16,
+):
+    """
+    生成数据集并运行全部基准测试
+
+    多线程扩展测试使用单独生成的 scaling_folders 个子文件夹（不少于 folders），
+    让每个线程都分到多个子文件夹
+
+    返回:
+        报告字典（meta、config、results）
+    """
+    root = workdir or tempfile.mkdtemp(prefix="perfbench_")
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "resolutions": [f"{w}x{h}" for w, h in resolutions],
+            "folders": folders,
+            "frames": frames,
+            "seed": seed,
+            "repeat": repeat,
+            "threads": list(threads),
+            "executor": executor,
+            "scaling_folders": max(folders, scaling_folders),
+        },
+        "results": [],
+    }
+    try:
+        for resolution in resolutions:
+            label = f"{resolution[0]}x{resolution[1]}"
+            print(f"【基准】生成数据集 {label}（{folders} 组 × {frames} 帧）")
+            dataset = generate_dataset(root, resolution, folders, frames, seed)
+            print(f"【基准】{label}: 检测器单帧耗时")
+            detectors = bench_detectors(dataset, repeat)
+            print(f"【基准】{label}: trails 搜索策略")
+            trails_results = bench_trails(dataset)
+            scaling_dataset = dataset
+            if scaling_folders > folders:
+                print(
+                    f"【基准】生成多线程扩展数据集 {label}（{scaling_folders} 组 × {frames} 帧）"
+                )
+                scaling_dataset = generate_dataset(
+                    os.path.join(root, "scaling"),
+                    resolution,
+                    scaling_folders,
+                    frames,
+                    seed,
+                )
+            print(f"【基准】{label}: 多线程扩展")
+            scaling = bench_scaling(scaling_dataset, threads, executor)
+            report["results"].append(
+                {
+                    "resolution": label,
+                    "detectors": detectors,
+                    "trails": trails_results,
+                    "scaling": scaling,
+                }
+            )
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def run_checks(resolutions, folders, frames, seed, tolerance=0.1, workdir=None):
+    """
+    生成数据集并运行结果一致性检查（金字塔匹配与全图匹配）
+
+    返回:
+        (全部通过, 结果列表)
+    """
+    root = workdir or tempfile.mkdtemp(prefix="perfbench_")
+    results = []
+    try:
+        for resolution in resolutions:
+            label = f"{resolution[0]}x{resolution[1]}"
+            print(f"【检查】生成数据集 {label}（{folders} 组 × {frames} 帧）")
+            dataset = generate_dataset(root, resolution, folders, frames, seed)
+            for result in check_pyramid(dataset, tolerance=tolerance):
+                result["resolution"] = label
+                results.append(result)
+                print(
+                    f"{'✅' if result['ok'] else '⛔'} 【检查】{label} 金字塔 {result['levels']} 层，裁剪 {result['crop']}: 判定不一致 {result['verdict_mismatches']}/{result['frames']} 帧，置信度最大相差 {result['max_confidence_diff']}（{result['confidence_diffs']} 帧不同）"
+                )
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return all(result["ok"] for result in results), results
+
+
+# ========== 报告对比 ==========
+def _flatten(report):
+    """将报告展开为 {指标名: 数值}，用于两次运行对比"""
+    metrics = {}
+    for entry in report["results"]:
+        res = entry["resolution"]
+        for d in entry["detectors"]:
+            metrics[f"{res}/detector/{d['detector']}/ms_median"] = d["ms_median"]
+        for t in entry["trails"]:
+            key = f"{res}/trails/{t['task']}/{t['search']}/leap{t['leap']}"
+            metrics[f"{key}/evaluated"] = t["evaluated"]
+            metrics[f"{key}/wall_s"] = t["wall_s"]
+        for s in entry["scaling"]:
+            metrics[f"{res}/scaling/threads{s['threads']}/wall_s"] = s["wall_s"]
+    return metrics
+
+
+def compare_reports(old, new):
+    """
+    对比两次基准报告，输出各指标的新旧值与比值（新/旧，耗时类小于 1 表示变快）
+
+    返回:
+        对比结果列表 [(指标名, 旧值, 新值, 比值)]
+    """
+    old_metrics, new_metrics = _flatten(old), _flatten(new)
+    rows = []
+    for key in sorted(old_metrics.keys() & new_metrics.keys()):
+        a, b = old_metrics[key], new_metrics[key]
+        rows.append((key, a, b, round(b / a, 3) if a else None))
+    return rows
+
+
+def _parse_resolutions(text):
+    return [tuple(int(v) for v in item.split("x")) for item in text.split(",")]
+
+
+if __name__ == "__main__":
+    # 使用示例: python PerfBench.py --output bench.json --resolutions 360x640,720x1280 --threads 1,2,4
+    #          python PerfBench.py --compare old.json new.json
+    #          python PerfBench.py --check   # 结果一致性检查，不通过时退出码为 1
+    parser = argparse.ArgumentParser(description="Perf Garden 基准测试")
+    parser.add_argument("--output", default="bench.json", help="结果 JSON 文件路径")
+    parser.add_argument(
+        "--resolutions",
+        default="360x640,720x1280",
+        help="分辨率列表（宽x高，逗号分隔）",
+    )
+    parser.add_argument("--folders", type=int, default=4, help="每种分辨率的子文件夹数")
+    parser.add_argument("--frames", type=int, default=120, help="每个子文件夹的帧数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="检测器单帧耗时的重复次数"
+    )
+    parser.add_argument("--threads", default="1,2,4", help="多线程扩展测试的线程数列表")
+    parser.add_argument(
+        "--executor", choices=("thread", "process"), default="thread", help="并行方式"
+    )
+    parser.add_argument(
+        "--scaling-folders",
+        type=int,
+        default=16,
+        help="多线程扩展测试的子文件夹数（应明显多于最大线程数）",
+    )
+    parser.add_argument("--workdir", default=None, help="数据集目录，指定时保留数据集")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两个结果 JSON 文件"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="只运行结果一致性检查（金字塔匹配与全图匹配判定相同），不通过时退出码为 1",
+    )
+    parser.add_argument(
+        "--pyramid-tolerance",
+        type=float,
+        default=0.1,
+        help="一致性检查允许的金字塔匹配与全图匹配置信度之差",
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        passed, _ = run_checks(
+            _parse_resolutions(args.resolutions),
+            args.folders,
+            args.frames,
+            args.seed,
+            args.pyramid_tolerance,
+            args.workdir,
+        )
+        print(f"🌾 一致性检查{'通过' if passed else '未通过'}")
+        sys.exit(0 if passed else 1)
+    elif args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path, "r", encoding="utf-8") as f:
+                reports.append(json.load(f))
+        for key, a, b, ratio in compare_reports(*reports):
+            print(f"{key}: {a} -> {b} ({ratio})")
+    else:
+        report = run_benchmarks(
+            _parse_resolutions(args.resolutions),
+            args.folders,
+            args.frames,
+            args.seed,
+            args.repeat,
+            [int(v) for v in args.threads.split(",")],
+            args.executor,
+            args.workdir,
+            args.scaling_folders,
+        )
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"🌾 基准测试完成，结果已保存到 {args.output}")
@@ -1,82 +1,1331 @@
 import argparse
 import concurrent.futures
+import contextlib
 import csv
+import hashlib
+import http.server
+import inspect
+import json
+import multiprocessing
 import os
 import queue
 import re
+import signal
+import socketserver
+import sqlite3
+import stat
 import threading
 import time
+import weakref
+from collections import OrderedDict, defaultdict
 
 import cv2  # pip install opencv-python
 import numpy as np  # pip install numpy
 import yaml  # pip install pyyaml
 
 
+# ========== 逐帧追踪：记录每帧读取、解码、预处理、计算耗时，多线程下可用 ==========
+class _Span:
+    """追踪区间，退出时记录一条事件"""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer._record(self.name, self.start, end - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    线程安全的逐帧追踪器，所有子文件夹线程共享
+
+    每帧检测记录一个 frame 区间，内含 read（读取文件）、decode（解码）、
+    preprocess（裁剪、缩放）、compute（匹配计算）子区间，并标记子文件夹、任务与线程。
+    未启用时 span 返回空上下文，几乎没有开销；不依赖 Debug 模式，多线程、多进程下均可用。
+
+    导出格式由文件扩展名决定：.jsonl 每行一条事件，其余为 Chrome trace JSON
+    （可在 chrome://tracing 或 Perfetto 中打开）。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def set_context(self, **tags):
+        """设置当前线程的标记（subfolder、task），之后的事件均带有这些标记"""
+        self._local.__dict__.update(tags)
+
+    def context(self) -> dict:
+        """返回当前线程的标记"""
+        return dict(self._local.__dict__)
+
+    def span(self, name: str, **args):
+        """返回追踪区间上下文，未启用时返回空上下文"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def wrap(self, func):
+        """包装函数，使其在其他线程（如预取线程）中执行时沿用当前线程的标记"""
+        if not self.enabled:
+            return func
+        tags = self.context()
+
+        def wrapped(*args, **kwargs):
+            self.set_context(**tags)
+            return func(*args, **kwargs)
+
+        return wrapped
+
+    def _record(self, name, start, duration, args):
+        thread = threading.current_thread()
+        event = (
+            name,
+            start // 1000,
+            duration / 1000,
+            os.getpid(),
+            thread.ident,
+            thread.name,
+            getattr(self._local, "subfolder", None),
+            getattr(self._local, "task", None),
+            args,
+        )
+        with self._lock:
+            self.events.append(event)
+
+    def drain(self) -> list:
+        """取出并清空已记录的事件（进程池子进程将事件随结果返回主进程）"""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def extend(self, events):
+        """合并其他进程记录的事件"""
+        with self._lock:
+            self.events.extend(events)
+
+    def export(self, path: str):
+        """
+        导出已记录的事件
+
+        参数:
+            path: 输出文件路径，.jsonl 为逐行事件，其余为 Chrome trace JSON
+
+        返回:
+            导出的事件数
+        """
+        events = self.drain()
+        origin = min((event[1] for event in events), default=0)
+        with open(path, "w", encoding="utf-8") as f:
+            if path.lower().endswith(".jsonl"):
+                for name, ts, dur, pid, tid, thread, subfolder, task, args in events:
+                    record = {
+                        "name": name,
+                        "ts_us": ts - origin,
+                        "dur_us": round(dur, 1),
+                        "pid": pid,
+                        "thread": thread,
+                        "subfolder": subfolder,
+                        "task": task,
+                    }
+                    record.update(args)
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                trace_events = []
+                threads = {}
+                for name, ts, dur, pid, tid, thread, subfolder, task, args in events:
+                    threads[(pid, tid)] = thread
+                    trace_events.append(
+                        {
+                            "name": name,
+                            "cat": "perfgarden",
+                            "ph": "X",
+                            "ts": ts - origin,
+                            "dur": round(dur, 1),
+                            "pid": pid,
+                            "tid": tid,
+                            "args": {"subfolder": subfolder, "task": task, **args},
+                        }
+                    )
+                for (pid, tid), thread in threads.items():
+                    trace_events.append(
+                        {
+                            "name": "thread_name",
+                            "ph": "M",
+                            "pid": pid,
+                            "tid": tid,
+                            "args": {"name": thread},
+                        }
+                    )
+                json.dump(
+                    {"traceEvents": trace_events, "displayTimeUnit": "ms"},
+                    f,
+                    ensure_ascii=False,
+                )
+        return len(events)
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+tracer = Tracer()
+
+
+# ========== 实时指标：吞吐、进度、队列深度，以 Prometheus 文本格式导出 ==========
+class Metrics:
+    """
+    线程安全的实时指标，所有子文件夹线程共享
+
+    计数器（单调递增）与可加减的仪表以 (指标名, 标签) 为键保存，未启用时 inc/add 直接返回。
+    进程池子进程设置 sink（Manager 队列）后，每秒将累计增量送回主进程合并。
+    """
+
+    # 指标名 -> (类型, 说明)
+    HELP = {
+        "perfgarden_frames_decoded_total": ("counter", "已解码的帧数"),
+        "perfgarden_read_seconds_total": ("counter", "读取图片文件的累计耗时"),
+        "perfgarden_decode_seconds_total": ("counter", "解码的累计耗时"),
+        "perfgarden_detector_calls_total": ("counter", "按任务类型统计的检测调用次数"),
+        "perfgarden_detector_seconds_total": (
+            "counter",
+            "按任务类型统计的检测累计耗时",
+        ),
+        "perfgarden_subfolders_done_total": ("counter", "已完成的子文件夹数"),
+        "perfgarden_subfolders_failed_total": ("counter", "处理出错的子文件夹数"),
+        "perfgarden_subfolders_total": ("gauge", "本次运行需处理的子文件夹数"),
+        "perfgarden_subfolders_pending": ("gauge", "尚未完成的子文件夹数"),
+        "perfgarden_workers": ("gauge", "工作线程（进程）数"),
+        "perfgarden_csv_queue_depth": ("gauge", "CSV 写入队列中等待写入的行数"),
+        "perfgarden_frames_decoded_per_second": ("gauge", "最近一个采样周期的解码速度"),
+        "perfgarden_detector_calls_per_second": ("gauge", "最近一个采样周期的检测速度"),
+        "perfgarden_worker_utilization": (
+            "gauge",
+            "最近一个采样周期内检测耗时占工作线程总时间的比例",
+        ),
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.sink = None
+        self.values = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器增加 value（仪表同样可用 inc 增减）"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] += value
+        if self.sink is not None and time.monotonic() - self._last_flush >= 1:
+            self.flush()
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表值"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def get(self, name: str, **labels) -> float:
+        """读取指标值"""
+        with self._lock:
+            return self.values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def flush(self):
+        """子进程：将累计增量送回主进程并清零"""
+        with self._lock:
+            delta, self.values = dict(self.values), defaultdict(float)
+            self._last_flush = time.monotonic()
+        if delta and self.sink is not None:
+            self.sink.put(delta)
+
+    def merge(self, delta: dict):
+        """主进程：合并子进程送回的增量"""
+        with self._lock:
+            for key, value in delta.items():
+                self.values[key] += value
+
+    def snapshot(self) -> dict:
+        """返回所有指标的副本"""
+        with self._lock:
+            return dict(self.values)
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式输出所有指标"""
+        by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.snapshot().items()):
+            by_name[name].append((labels, value))
+        lines = []
+        for name, samples in by_name.items():
+            kind, help_text = self.HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}{label_text} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.values.clear()
+
+
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """
+    指标采样与导出线程（主进程）
+
+    每个采样周期合并子进程增量、计算解码与检测速度、CSV 队列深度和工作线程利用率，
+    并按配置写入 Prometheus 文本文件（先写临时文件再替换，可供 node_exporter 收集），
+    或在本机 HTTP 端口的 /metrics 上提供。
+
+    参数:
+        interval: 采样周期（秒）
+        workers: 工作线程（进程）数
+        csv_queue: CSV 写入队列
+        textfile: 文本文件路径，空表示不写文件
+        port: HTTP 端口，0 表示不启动
+        sink: 子进程增量队列（进程池模式），默认为None
+    """
+
+    def __init__(self, interval, workers, csv_queue, textfile="", port=0, sink=None):
+        self.interval = interval
+        self.workers = workers
+        self.csv_queue = csv_queue
+        self.textfile = textfile
+        self.sink = sink
+        self.server = None
+        self._stop = threading.Event()
+        self._previous = (time.monotonic(), metrics.snapshot())
+        metrics.set("perfgarden_workers", workers)
+
+        if port:
+            reporter = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = reporter.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header(
+                        "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                    )
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass  # 不输出访问日志
+
+            try:
+                self.server = http.server.ThreadingHTTPServer(
+                    ("127.0.0.1", port), Handler
+                )
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                print(f"【指标】已在 http://127.0.0.1:{port}/metrics 提供实时指标")
+            except OSError as e:
+                print(f"🟠 【警告】无法监听指标端口 {port}，已禁用 HTTP 指标: {e}")
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        """合并子进程送回的增量"""
+        if self.sink is None:
+            return
+        while True:
+            try:
+                metrics.merge(self.sink.get_nowait())
+            except (queue.Empty, EOFError, OSError):
+                return
+
+    def sample(self):
+        """采样一次：更新速度、队列深度与利用率仪表"""
+        self._drain()
+        now = time.monotonic()
+        current = metrics.snapshot()
+        last_time, last = self._previous
+        elapsed = max(now - last_time, 1e-9)
+        self._previous = (now, current)
+
+        def delta(key):
+            return current.get(key, 0) - last.get(key, 0)
+
+        metrics.set(
+            "perfgarden_frames_decoded_per_second",
+            round(delta(("perfgarden_frames_decoded_total", ())) / elapsed, 2),
+        )
+        busy = 0.0
+        for name, labels in current:
+            if name == "perfgarden_detector_calls_total":
+                metrics.set(
+                    "perfgarden_detector_calls_per_second",
+                    round(delta((name, labels)) / elapsed, 2),
+                    **dict(labels),
+                )
+            elif name == "perfgarden_detector_seconds_total":
+                busy += delta((name, labels))
+        metrics.set(
+            "perfgarden_worker_utilization",
+            round(min(1.0, busy / (elapsed * max(self.workers, 1))), 3),
+        )
+        try:
+            metrics.set("perfgarden_csv_queue_depth", self.csv_queue.qsize())
+        except (NotImplementedError, OSError, EOFError):
+            pass
+
+    def render(self) -> str:
+        return metrics.render()
+
+    def _write_textfile(self):
+        tmp_path = self.textfile + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(metrics.render())
+            os.replace(tmp_path, self.textfile)
+        except OSError as e:
+            print(f"🟠 【警告】无法写入指标文件 {self.textfile}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if self.textfile:
+                self._write_textfile()
+
+    def close(self):
+        """停止采样，写入最终指标并关闭 HTTP 服务"""
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        if self.textfile:
+            self._write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+# ========== 内存预算：所有工作线程共享的解码帧内存上限，超出时解码等待 ==========
+class MemoryBudget:
+    """
+    全局解码帧内存预算（线程安全）
+
+    在解码处登记每个解码得到的帧（含彩色解码、视频 BGR 帧等中间结果），
+    帧对象被释放（检测完成、缓存淘汰）时自动归还；模板缓存只保留不登记的副本。
+    已登记的内存加上一帧的大小超过上限时，先让各帧缓存淘汰旧帧，仍不足时
+    解码前等待其他线程释放，使峰值内存不随线程数增长。已登记的内存全部由
+    当前线程持有时无人可以释放，不等待直接解码；若长时间无人释放，
+    等待超时后仍继续解码。两种情况均计入超额次数，避免卡死。
+
+    参数:
+        max_mb: 内存上限（MB），0 表示不限制（只统计峰值）
+        stall: 无人释放时最长等待秒数
+    """
+
+    def __init__(self, max_mb: float = 0, stall: float = 1.0):
+        self.stall = stall
+        self._cond = threading.Condition()
+        self._caches = weakref.WeakSet()  # 预算不足时可淘汰的帧缓存
+        self.used = 0  # 已登记且尚未回收的帧内存
+        self._owned = {}  # 线程 ID -> 该线程登记且尚未回收的帧内存
+        self.configure(max_mb)
+
+    def configure(self, max_mb: float):
+        """设置内存上限并清零统计（每次批处理开始时调用，不影响仍在使用的帧）"""
+        with self._cond:
+            self.limit = int(max_mb * 1024 * 1024)
+            self.peak = self.used
+            self.frame_bytes = 0  # 最近一帧的大小，作为下一帧的预估
+            self.waits = 0  # 等待次数
+            self.wait_seconds = 0.0  # 累计等待时间
+            self.overcommits = 0  # 等待超时后超额解码的次数
+
+    def register(self, cache):
+        """登记帧缓存（FrameCache），预算不足时调用其 shrink 淘汰旧帧"""
+        self._caches.add(cache)
+
+    def over(self) -> bool:
+        """是否已无法再容纳一帧"""
+        return bool(self.limit) and self.used + self.frame_bytes > self.limit
+
+    def reserve(self):
+        """解码前调用：内存不足时先淘汰缓存帧，仍不足时等待其他线程释放"""
+        if not self.limit or not self.over():
+            return
+        # 在锁外淘汰：被淘汰的帧回收时会调用 _release
+        for cache in list(self._caches):
+            cache.shrink()
+        owner = threading.get_ident()
+        with self._cond:
+            if self.used == 0 or not self.over():
+                return
+            if self._owned.get(owner, 0) >= self.used:  # 只有自己持有，等待无意义
+                self.overcommits += 1
+                return
+            self.waits += 1
+            start = time.perf_counter()
+            while self.used > self._owned.get(owner, 0) and self.over():
+                if not self._cond.wait(self.stall):  # 等待期间无人释放
+                    self.overcommits += 1
+                    break
+            self.wait_seconds += time.perf_counter() - start
+
+    def charge(self, frame, estimate: bool = True):
+        """
+        登记解码得到的帧，帧对象被回收时自动归还
+
+        参数:
+            estimate: 是否以该帧大小作为下一帧的预估；由彩色中间结果转换得到的
+                      灰度帧传 False，使预估包含解码时的峰值
+
+        返回:
+            原帧（便于直接 return）
+        """
+        if frame is None:
+            return frame
+        nbytes = frame.nbytes
+        owner = threading.get_ident()
+        with self._cond:
+            self.used += nbytes
+            self._owned[owner] = self._owned.get(owner, 0) + nbytes
+            self.peak = max(self.peak, self.used)
+            if estimate:
+                self.frame_bytes = nbytes
+        weakref.finalize(frame, self._release, nbytes, owner)
+        return frame
+
+    def _release(self, nbytes: int, owner: int):
+        with self._cond:
+            self.used -= nbytes
+            owned = self._owned.pop(owner) - nbytes
+            if owned:
+                self._owned[owner] = owned
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """返回统计 {"peak_mb", "limit_mb", "waits", "wait_seconds", "overcommits"}"""
+        with self._cond:
+            return {
+                "peak_mb": round(self.peak / 1024 / 1024, 1),
+                "limit_mb": round(self.limit / 1024 / 1024, 1),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 2),
+                "overcommits": self.overcommits,
+            }
+
+
+memory_budget = MemoryBudget()
+
+
+# ========== 模板缓存：同一模板在整个批处理中只解码、预处理一次 ==========
+def _crop_image(img, crop: int):
+    """
+    按裁剪比例裁剪图片
+
+    参数:
+        img: 图片数组
+        crop: 裁剪比例 (-99~99)，>0 保留底部，<0 保留顶部，=0 不裁剪
+
+    返回:
+        裁剪后的图片（视图，不复制数据）
+    """
+    if crop == 0:
+        return img
+    h = img.shape[0]
+    if crop > 0:
+        # 保留底部区域
+        new_h = max(1, int(h * (100 - crop) / 100))
+        return img[h - new_h : h, :]
+    # 保留顶部区域
+    new_h = max(1, int(h * abs(crop) / 100))
+    return img[0:new_h, :]
+
+
+# 解码方式 -> OpenCV 读取标志；gray/N 直接按 1/N 分辨率解码（JPEG 在 DCT 域缩放）
+DECODE_FLAGS = {
+    "gray": cv2.IMREAD_GRAYSCALE,
+    "gray/2": cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    "gray/4": cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    "gray/8": cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _gray_mode(decode_scale: int = 1) -> str:
+    """返回指定解码倍数对应的灰度解码方式（1 -> "gray"，2 -> "gray/2"）"""
+    return "gray" if decode_scale == 1 else f"gray/{decode_scale}"
+
+
+def _decode_gray(path: str, mode: str = "gray"):
+    """
+    安全读取图片为灰度图
+
+    参数:
+        path: 图片路径
+        mode: 解码方式
+              "gray" 直接解码为灰度（cactus、blover）
+              "gray/2"、"gray/4"、"gray/8" 直接按 1/2、1/4、1/8 分辨率解码为灰度
+              "bgr2gray" 解码为彩色后转灰度（cattail）
+
+    返回:
+        灰度图数组，读取失败返回None
+    """
+    try:
+        memory_budget.reserve()
+        start = time.perf_counter()
+        with tracer.span("read"):
+            data = np.fromfile(path, dtype=np.uint8)
+        read_end = time.perf_counter()
+        with tracer.span("decode", mode=mode):
+            if mode == "bgr2gray":
+                # 彩色中间结果同样登记，转换期间两者同时占用内存
+                color = memory_budget.charge(cv2.imdecode(data, cv2.IMREAD_COLOR))
+                img = None if color is None else cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+                del color
+            else:
+                img = cv2.imdecode(data, DECODE_FLAGS[mode])
+        if metrics.enabled:
+            metrics.inc("perfgarden_read_seconds_total", read_end - start)
+            decode_time = time.perf_counter() - read_end
+            metrics.inc("perfgarden_decode_seconds_total", decode_time)
+            metrics.inc("perfgarden_frames_decoded_total")
+        return memory_budget.charge(img, estimate=mode != "bgr2gray")
+    except:
+        return None
+
+
+class PreparedTemplate:
+    """
+    预处理完成的模板（已灰度化、裁剪、下采样）
+
+    属性:
+        gray: 预处理后的灰度模板
+        shape: 下采样前（裁剪后）的尺寸，用于与待检测图片做尺寸校验
+    """
+
+    __slots__ = ("gray", "shape")
+
+    def __init__(self, gray, shape):
+        self.gray = gray
+        self.shape = shape
+
+
+def _mtime(path):
+    """返回文件修改时间（纳秒），文件不存在时返回None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class TemplateCache:
+    """
+    线程安全的模板缓存，所有任务、子文件夹线程共享
+
+    以 (模板路径, 解码方式, 裁剪, 下采样倍数) 为键，按 LRU 淘汰，
+    避免 cactus 以各子文件夹首帧为模板时缓存无限增长。
+    命中次数含 PreparedDetector 每次调用复用编译时模板的次数，即节省的模板解码次数。
+
+    参数:
+        max_entries: 最多缓存的模板数量
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._mtimes = {}  # 键 -> 缓存时模板文件的修改时间
+        self._lock = threading.Lock()
+
+    def get(self, template_path, mode="gray", crop=0, scale=1, frame_cache=None):
+        """
+        获取预处理模板，未命中时解码并缓存
+
+        参数:
+            frame_cache: 提供时经由帧缓存读取（cactus 以视频首帧为模板时使用）
+
+        返回:
+            PreparedTemplate，读取失败返回None（失败结果不缓存）
+        """
+        key = (os.path.normpath(template_path), mode, crop, scale)
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+            self.misses += 1
+
+        with tracer.span("template", mode=mode):
+            gray = _read_frame(template_path, mode, frame_cache)
+            if gray is None:
+                return None
+            gray = _crop_image(gray, crop)
+            shape = gray.shape
+            if scale > 1:
+                new_h, new_w = shape[0] // scale, shape[1] // scale
+                gray = cv2.resize(gray, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            # 复制后缓存：登记的解码帧随即归还，常驻的模板不占用解码内存预算
+            prepared = PreparedTemplate(gray.copy(), shape)
+
+        with self._lock:
+            self._entries[key] = prepared
+            self._mtimes[key] = _mtime(key[0])
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._mtimes.pop(evicted, None)
+        return prepared
+
+    def refresh(self) -> int:
+        """
+        移除模板文件已修改或已删除的缓存（常驻服务每个任务开始前调用）
+
+        返回:
+            移除的模板数
+        """
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if _mtime(key[0]) is None or _mtime(key[0]) != self._mtimes.get(key)
+            ]
+            for key in stale:
+                del self._entries[key]
+                self._mtimes.pop(key, None)
+        return len(stale)
+
+    def reuse(self, count: int = 1):
+        """登记复用已编译模板的次数（PreparedDetector 每次调用时）"""
+        with self._lock:
+            self.hits += count
+
+    def stats(self) -> dict:
+        """返回统计 {"hits"（节省的解码次数）, "misses"（实际解码次数）, "size"}"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+template_cache = TemplateCache()
+
+
+# ========== 缩略图索引：低分辨率灰度帧保存为内存映射文件，多次分析不重复解码 ==========
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif")
+
+
+class ThumbnailIndex:
+    """
+    子文件夹缩略图索引，调参时对同一批图片反复运行不同配置无需重复解码原图
+
+    所有图片按 1/scale 分辨率解码为灰度后堆叠保存为子文件夹内的 .npy 旁路文件，
+    以内存映射方式读取；文件列表及各图片的大小、修改时间保存在同名 .json 中，
+    图片增删或修改后自动重建。图片尺寸不一致或无法写入时不建立索引，照常解码原图。
+    作为 FrameCache 的解码函数使用：解码方式与索引一致时直接返回索引中的帧。
+
+    参数:
+        subfolder: 子文件夹路径
+        image_files: 排序后的图片文件名列表
+        scale: 缩略倍数 (2/4/8)，与任务的 decode_scale 一致时命中
+    """
+
+    def __init__(self, subfolder: str, image_files: list, scale: int = 4):
+        self.scale = scale
+        self.mode = _gray_mode(scale)
+        self.hits = 0
+        self._lock = threading.Lock()  # 多个线程读取同一索引（推测检测、预取）
+        self.rebuilt = False
+        self.frames = None
+        self.index = {name: i for i, name in enumerate(image_files)}
+        base = os.path.join(subfolder, f".perfgarden_thumbs_{scale}x")
+        self.npy_path = base + ".npy"
+        self.json_path = base + ".json"
+
+        manifest = {
+            "mode": self.mode,
+            "files": [
+                [name, stat.st_size, stat.st_mtime_ns]
+                for name, stat in (
+                    (name, os.stat(os.path.join(subfolder, name)))
+                    for name in image_files
+                )
+            ],
+        }
+        if not self._load(manifest):
+            self._build(subfolder, manifest)
+
+    def _load(self, manifest):
+        """读取已有索引，文件列表不一致时返回False"""
+        try:
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                if json.load(f) != manifest:
+                    return False
+            self.frames = np.load(self.npy_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return False
+        return len(self.frames) == len(manifest["files"])
+
+    def _build(self, subfolder, manifest):
+        """解码所有图片并写入索引（先写临时文件再替换，中断时不留下不完整的索引）"""
+        names = [name for name, _, _ in manifest["files"]]
+        if not names:
+            return
+        first = _decode_gray(os.path.join(subfolder, names[0]), self.mode)
+        if first is None:
+            return
+
+        tmp_path = self.npy_path + ".tmp"
+        try:
+            frames = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.uint8, shape=(len(names),) + first.shape
+            )
+            frames[0] = first
+            for i, name in enumerate(names[1:], start=1):
+                gray = _decode_gray(os.path.join(subfolder, name), self.mode)
+                if gray is None or gray.shape != first.shape:
+                    print(
+                        f"🟠 【警告】图片 {name} 无法读取或尺寸不一致，不建立缩略图索引: {subfolder}"
+                    )
+                    del frames
+                    os.remove(tmp_path)
+                    return
+                frames[i] = gray
+            frames.flush()
+            del frames
+            os.replace(tmp_path, self.npy_path)
+            with open(self.json_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            self.frames = np.load(self.npy_path, mmap_mode="r")
+            self.rebuilt = True
+        except OSError as e:
+            print(f"🟠 【警告】无法写入缩略图索引，照常解码原图: {e}")
+
+    def frame(self, path: str):
+        """返回索引中的帧，不在索引中时返回None"""
+        if self.frames is None:
+            return None
+        i = self.index.get(os.path.basename(path))
+        if i is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        with tracer.span("read", source="thumbnails"):
+            return np.array(self.frames[i])
+
+    def decode(self, path: str, mode: str = "gray"):
+        """解码函数：解码方式与索引一致时读取索引，否则解码原图"""
+        if mode == self.mode:
+            frame = self.frame(path)
+            if frame is not None:
+                return frame
+        return _decode_gray(path, mode)
+
+    def close(self):
+        """释放内存映射"""
+        self.frames = None
+
+
+# ========== 帧缓存：子文件夹内回跳、连续任务不重复解码 ==========
+class FrameCache:
+    """
+    子文件夹级别的已解码帧缓存（LRU，按内存上限淘汰）
+
+    以 (图片路径, 解码方式) 为键缓存灰度帧，生命周期为一个子文件夹。
+    trails 回跳、fade 重读、后续任务从匹配帧继续时均可直接命中。
+
+    参数:
+        max_mb: 内存上限（MB），超出时淘汰最久未使用的帧，0 表示只解码不缓存
+        decoder: 解码函数 decoder(path, mode)，默认为None使用 _decode_gray 读取图片文件
+        thumbnails: 缩略图索引（ThumbnailIndex），提供且未指定 decoder 时经由索引解码
+    """
+
+    def __init__(self, max_mb: float = 64, decoder=None, thumbnails=None):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.thumbnails = thumbnails
+        if decoder is None and thumbnails is not None:
+            decoder = thumbnails.decode
+        self.decoder = decoder or _decode_gray
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        memory_budget.register(self)
+
+    def read(self, path: str, mode: str = "gray"):
+        """
+        读取灰度帧，命中时直接返回缓存（调用方不得原地修改）
+
+        返回:
+            灰度图数组，读取失败返回None
+        """
+        key = (path, mode)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        frame = self.decoder(path, mode)
+        if frame is None or frame.nbytes > self.max_bytes:
+            return frame
+
+        with self._lock:
+            if memory_budget.over():  # 全局内存预算已用尽时不再缓存新帧
+                return frame
+            if key not in self._frames:
+                self._frames[key] = frame
+                self.bytes += frame.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return frame
+
+    def shrink(self):
+        """全局内存预算不足时淘汰最久未使用的帧，直到预算足够或缓存为空"""
+        while memory_budget.over():
+            with self._lock:
+                if not self._frames:
+                    return
+                _, evicted = self._frames.popitem(last=False)
+                self.bytes -= evicted.nbytes
+            del evicted  # 在锁外回收
+
+    def thumbnail(self, path: str, scale: int):
+        """返回缩略图索引中 1/scale 分辨率的帧，无索引或倍数不一致时返回None"""
+        if self.thumbnails is None or self.thumbnails.scale != scale:
+            return None
+        return self.thumbnails.frame(path)
+
+    def stats(self) -> dict:
+        """返回统计 {"hits"（节省的解码次数）, "misses"（实际解码次数）, "mb"}"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "mb": round(self.bytes / 1024 / 1024, 1),
+            }
+
+
+# ========== 视频读取：直接从视频文件取帧，无需预先分帧 ==========
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".mov", ".avi")
+
+
+class VideoFrameSource:
+    """
+    视频文件帧读取器，以帧标签代替图片文件名，只解码搜索实际请求的帧
+
+    连续请求（leap=1、小步跳帧）时顺序 grab 跳过中间帧，跨度较大或回跳时按帧号 seek。
+    作为 FrameCache 的解码函数使用：FrameCache(max_mb, decoder=source.decode)
+
+    参数:
+        video_path: 视频文件路径
+        label: 帧标签格式，"index" 帧序号（如 "123"），"time" 时间戳（如 "2.050s"）
+    """
+
+    # 向后跨度不超过该帧数时顺序 grab，否则 seek
+    SEEK_DISTANCE = 16
+
+    def __init__(self, video_path: str, label: str = "index"):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        self.pos = 0  # 下一次 read 将返回的帧号
+        self._lock = threading.Lock()
+
+        frame_count = 0
+        fps = 0
+        if self.cap.isOpened():
+            frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = self.cap.get(cv2.CAP_PROP_FPS) or 0
+        else:
+            print(f"🟠 【警告】无法打开视频文件: {video_path}")
+
+        if label == "time" and fps > 0:
+            self.labels = [f"{i / fps:.3f}s" for i in range(frame_count)]
+        else:
+            self.labels = [str(i) for i in range(frame_count)]
+        self.index = {name: i for i, name in enumerate(self.labels)}
+
+    def decode(self, path: str, mode: str = "gray"):
+        """
+        读取帧标签对应的帧并按解码方式转为灰度图
+
+        参数:
+            path: 视频路径与帧标签拼接的路径（trails 以 os.path.join 生成）
+            mode: 解码方式，与 _decode_gray 相同
+
+        返回:
+            灰度图数组，读取失败返回None
+        """
+        index = self.index.get(os.path.basename(path))
+        if index is None:
+            return None
+
+        memory_budget.reserve()
+        with tracer.span("decode", source="video"), self._lock:
+            if index < self.pos or index - self.pos > self.SEEK_DISTANCE:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            else:
+                for _ in range(index - self.pos):
+                    self.cap.grab()
+            ok, frame = self.cap.read()
+            self.pos = index + 1
+        if not ok:
+            return None
+        metrics.inc("perfgarden_frames_decoded_total")
+        frame = memory_budget.charge(frame)  # BGR 帧转换期间与灰度帧同时占用内存
+
+        with tracer.span("preprocess", source="video"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            del frame
+            if mode.startswith("gray/"):
+                # 与 IMREAD_REDUCED_* 的输出尺寸一致（向上取整）
+                scale = int(mode[5:])
+                h, w = gray.shape
+                size = (-(-w // scale), -(-h // scale))
+                gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return memory_budget.charge(gray, estimate=False)
+
+    def release(self):
+        """释放视频句柄"""
+        with self._lock:
+            self.cap.release()
+
+
+# ========== 帧预取：后台解码 trails 接下来要检测的帧 ==========
+class FramePrefetcher:
+    """
+    帧预取器，在后台线程中提前解码 trails 接下来要检测的帧，与检测计算重叠
+
+    trails 每检测一帧前按当前位置和 leap 调用 schedule 提交后续候选帧；
+    回跳或切换为逐帧检查时，不在新候选列表中的未开始预取被取消。
+    读取接口与 FrameCache 相同，可直接作为检测函数的 frame_cache 参数。
+
+    参数:
+        frame_cache: 帧缓存，预取与未命中的读取均经由该缓存解码
+        depth: 预取帧数
+    """
+
+    def __init__(self, frame_cache: FrameCache, depth: int = 4):
+        self.frame_cache = frame_cache
+        self.depth = depth
+        self.issued = 0  # 提交的预取数
+        self.hits = 0  # 读取时已预取（含正在解码）的次数
+        self.misses = 0  # 读取时未预取的次数
+        self.dropped = 0  # 失效取消的预取数
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(depth, 4), thread_name_prefix="prefetch"
+        )
+
+    def schedule(self, paths, mode):
+        """
+        提交候选帧预取，取消不在新候选列表中的未开始预取
+
+        参数:
+            paths: 候选帧路径列表（按检测顺序，含当前即将读取的帧）
+            mode: 解码方式
+        """
+        keys = [(path, mode) for path in paths]
+        with self._lock:
+            for key in list(self._pending):
+                if key in keys:
+                    continue
+                future = self._pending[key]
+                if future.cancel():
+                    self.dropped += 1
+                    del self._pending[key]
+                elif future.done():
+                    del self._pending[key]  # 已解码的帧保留在帧缓存中
+            # 当前帧未预取时由调用方直接解码，只为后续帧提交预取
+            for key in keys[1:]:
+                if key not in self._pending:
+                    self._pending[key] = self._executor.submit(
+                        tracer.wrap(self.frame_cache.read), *key
+                    )
+                    self.issued += 1
+
+    def read(self, path: str, mode: str = "gray"):
+        """读取灰度帧，已预取时等待并返回预取结果"""
+        with self._lock:
+            future = self._pending.pop((path, mode), None)
+            if future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if future is not None:
+            with tracer.span("prefetch_wait"):
+                return future.result()
+        return self.frame_cache.read(path, mode)
+
+    def thumbnail(self, path: str, scale: int):
+        """返回缩略图索引中的帧，见 FrameCache.thumbnail"""
+        return self.frame_cache.thumbnail(path, scale)
+
+    def close(self):
+        """取消所有未开始的预取并关闭后台线程"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        """返回统计 {"issued", "hits", "misses", "dropped"}"""
+        with self._lock:
+            return {
+                "issued": self.issued,
+                "hits": self.hits,
+                "misses": self.misses,
+                "dropped": self.dropped,
+            }
+
+
+class SpeculativeWindow:
+    """
+    推测检测窗口：固定宽度的协助线程，trails 检测当前帧的同时并行检测之后
+    width-1 个候选帧
+
+    trails 每检测一帧前调用 acquire 借用窗口名额，提交的检测完成（或取消）后
+    自动归还。结果按原顺序使用，匹配结果与逐个检测完全一致。
+
+    参数:
+        width: 窗口宽度（含当前帧在内同时检测的帧数）
+    """
+
+    def __init__(self, width: int):
+        self.slots = max(1, width - 1)  # 当前帧由子文件夹线程自己检测
+        self.borrowed = 0  # 已借出的名额
+        self.submitted = 0  # 提交的推测检测数
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.slots, thread_name_prefix="speculate"
+        )
+
+    def acquire(self, wanted: int) -> int:
+        """
+        借用窗口名额
+
+        返回:
+            借到的名额数（0 ~ wanted）
+        """
+        with self._lock:
+            count = max(0, min(wanted, self.slots - self.borrowed))
+            self.borrowed += count
+            return count
+
+    def release(self, count: int = 1):
+        """归还名额"""
+        with self._lock:
+            self.borrowed -= count
+
+    def submit(self, func, *args):
+        """在推测线程中执行 func（占用一个已借用名额，完成后归还）"""
+        future = self._executor.submit(tracer.wrap(func), *args)
+        future.add_done_callback(lambda _: self.release())
+        with self._lock:
+            self.submitted += 1
+        return future
+
+    def close(self):
+        """取消未开始的推测检测并关闭推测线程"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _read_frame(path: str, mode: str = "gray", frame_cache: FrameCache = None):
+    """读取灰度帧，提供 frame_cache 时经由缓存读取"""
+    if frame_cache is not None:
+        return frame_cache.read(path, mode)
+    return _decode_gray(path, mode)
+
+
+def _pyramid_levels(templates, levels: int) -> int:
+    """粗匹配模板边长至少 8 像素，否则减少金字塔层数，返回实际层数"""
+    min_side = min(min(prepared.gray.shape) for prepared in templates)
+    while levels > 0 and min_side >> levels < 8:
+        levels -= 1
+    return levels
+
+
+def _pyramid_match(
+    img, template, coarse_template, factor: int, top_k: int = 3, coarse=None
+):
+    """
+    金字塔模板匹配：先在 1/factor 分辨率下粗匹配，再在原分辨率下仅对候选位置附近精匹配
+
+    参数:
+        img: 灰度图片
+        template: 原分辨率灰度模板
+        coarse_template: 1/factor 分辨率灰度模板
+        factor: 粗匹配缩放倍数
+        top_k: 精匹配的候选位置数量
+        coarse: 1/factor 分辨率灰度图片（如缩略图索引中的帧），默认为None由 img 缩放得到
+
+    返回:
+        原分辨率下的最大匹配值（TM_CCOEFF_NORMED），与全图匹配含义一致
+    """
+    h, w = img.shape[:2]
+    th, tw = template.shape[:2]
+    ch, cw = coarse_template.shape[:2]
+
+    if coarse is None:
+        coarse = cv2.resize(
+            img, (w // factor, h // factor), interpolation=cv2.INTER_AREA
+        )
+    if ch > coarse.shape[0] or cw > coarse.shape[1]:
+        # 粗匹配图片过小，回退全图匹配
+        result = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
+        return cv2.minMaxLoc(result)[1]
+
+    coarse_result = cv2.matchTemplate(coarse, coarse_template, cv2.TM_CCOEFF_NORMED)
+
+    best = -1.0
+    for _ in range(top_k):
+        _, _, _, (cx, cy) = cv2.minMaxLoc(coarse_result)
+
+        # 原分辨率下候选位置附近的搜索窗口（向四周扩展 factor 像素容纳取整误差）
+        x0 = max(0, cx * factor - factor)
+        y0 = max(0, cy * factor - factor)
+        x1 = min(w, cx * factor + tw + factor)
+        y1 = min(h, cy * factor + th + factor)
+        window = img[y0:y1, x0:x1]
+        if window.shape[0] >= th and window.shape[1] >= tw:
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            best = max(best, cv2.minMaxLoc(result)[1])
+
+        # 抑制已选候选的邻域，选取下一个候选
+        coarse_result[
+            max(0, cy - ch // 2) : cy + ch // 2 + 1,
+            max(0, cx - cw // 2) : cx + cw // 2 + 1,
+        ] = -1.0
+    return best
+
+
 # 猫尾草：静态图片模板匹配，按钮标题等查找静态首尾帧
 def cattail(
-    img_path: str, template_path: str, threshold: float = 0.9, crop: int = 0
+    img_path: str,
+    template_path: str,
+    threshold: float = 0.9,
+    crop: int = 0,
+    template: PreparedTemplate = None,
+    frame_cache: FrameCache = None,
+    decode_scale: int = 1,
+    pyramid_levels: int = 0,
+    coarse_template: PreparedTemplate = None,
 ) -> tuple:
     """
     模板匹配检测函数（支持区域裁剪）
 
     参数：
     img_path: 待检测图片路径
-    template_path: 模板图片路径
+    template_path: 模板图片路径，也可以是路径列表（多个模板任一匹配即可，如深色/浅色主题）
     threshold: 匹配阈值 (0~1)
     crop: 裁剪比例 (-99~99)
           >0 从底部向上裁剪，保留底部
           <0 从顶部向下裁剪，保留顶部
           =0 不裁剪
+    template: 预处理模板（多模板时为列表），提供时不再读取 template_path
+    frame_cache: 子文件夹帧缓存，提供时经由缓存读取图片
+    decode_scale: 解码倍数 (1/2/4/8)，>1 时图片与模板均直接按 1/N 分辨率解码为灰度
+    pyramid_levels: 金字塔层数 (0~3)，>0 时先在 1/2^N 分辨率下粗匹配，再在原分辨率下
+                    精匹配候选位置，置信度仍为原分辨率结果；模板过小时自动减少层数；
+                    缩略图索引倍数与粗匹配分辨率一致时，粗匹配直接使用索引中的帧
+    coarse_template: 预处理的粗匹配模板（多模板时为列表，与 template 对应），
+                     提供时不再查询模板缓存
 
     返回：
     (status, matched, confidence, duration)
+    多模板时图片只解码、裁剪一次，依次与各模板匹配，confidence 为最高置信度，
+    并追加第五项 template（置信度最高的模板路径）：
+    (status, matched, confidence, duration, template)
     """
     start_time = time.time()
+    multi = isinstance(template_path, (list, tuple))
+    template_paths = list(template_path) if multi else [template_path]
 
     # 参数校验
-    if not (0 <= threshold <= 1) or not (-99 <= crop <= 99):
+    if (
+        not (0 <= threshold <= 1)
+        or not (-99 <= crop <= 99)
+        or decode_scale not in (1, 2, 4, 8)
+        or pyramid_levels not in (0, 1, 2, 3)
+    ):
         duration = round(time.time() - start_time, 2)
         return ("EC01", False, 0.00, duration)
 
-    # 安全读取图片
-    def _safe_read(path):
-        try:
-            return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-        except:
-            return None
-
-    img = _safe_read(img_path)
-    template = _safe_read(template_path)
+    # 安全读取图片（彩色解码后转灰度，逐像素转换与先裁剪后转换等价）
+    mode = "bgr2gray" if decode_scale == 1 else _gray_mode(decode_scale)
+    img = _read_frame(img_path, mode, frame_cache)
+    templates = template if isinstance(template, list) else [template]
+    if template is None and template_path:
+        templates = [template_cache.get(path, mode) for path in template_paths]
 
     # 读取失败判断
-    if img is None or template is None:
+    if img is None or any(prepared is None for prepared in templates):
         duration = round(time.time() - start_time, 2)
         return ("EC02", False, 0.00, duration)
 
     # 执行裁剪操作
-    if crop != 0:
-        h, w = img.shape[:2]
-        if crop > 0:
-            # 保留底部区域
-            new_h = max(1, int(h * (100 - crop) / 100))
-            img = img[h - new_h : h, :]
-        else:
-            # 保留顶部区域
-            new_h = max(1, int(h * abs(crop) / 100))
-            img = img[0:new_h, :]
-
-    # 模板尺寸校验
-    if (template.shape[0] > img.shape[0]) or (template.shape[1] > img.shape[1]):
-        duration = round(time.time() - start_time, 2)
-        return ("EC03", False, 0.00, duration)
-
-    # 灰度转换
-    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-
-    # 执行匹配
-    result = cv2.matchTemplate(img_gray, template_gray, cv2.TM_CCOEFF_NORMED)
-    _, max_val, _, _ = cv2.minMaxLoc(result)
+    with tracer.span("preprocess"):
+        img = _crop_image(img, crop)
+
+        # 模板尺寸校验
+        for prepared in templates:
+            if (prepared.gray.shape[0] > img.shape[0]) or (
+                prepared.gray.shape[1] > img.shape[1]
+            ):
+                duration = round(time.time() - start_time, 2)
+                return ("EC03", False, 0.00, duration)
+
+        pyramid_levels = _pyramid_levels(templates, pyramid_levels)
+
+    # 执行匹配（多模板时取置信度最高者，相同时取靠前的模板）
+    with tracer.span("compute", templates=len(templates)):
+        coarse = None
+        if pyramid_levels > 0 and template_path:
+            factor = 2**pyramid_levels
+            if frame_cache is not None:
+                coarse = frame_cache.thumbnail(img_path, decode_scale * factor)
+                if coarse is not None:
+                    coarse = _crop_image(coarse, crop)
+            coarse_templates = coarse_template or [None] * len(templates)
+            if not isinstance(coarse_templates, list):
+                coarse_templates = [coarse_templates]
+        max_val, best = -1.0, 0
+        for idx, prepared in enumerate(templates):
+            if pyramid_levels > 0 and template_path:
+                coarse_prepared = coarse_templates[idx]
+                if coarse_prepared is None:
+                    coarse_prepared = template_cache.get(
+                        template_paths[idx], mode, 0, factor
+                    )
+                val = _pyramid_match(
+                    img, prepared.gray, coarse_prepared.gray, factor, coarse=coarse
+                )
+            else:
+                result = cv2.matchTemplate(img, prepared.gray, cv2.TM_CCOEFF_NORMED)
+                _, val, _, _ = cv2.minMaxLoc(result)
+            if val > max_val:
+                max_val, best = val, idx
 
     # 精度处理
     confidence = round(float(max_val), 2)
@@ -84,6 +1333,8 @@ def cattail(
     status = "PASS"
     matched = confidence >= threshold
 
+    if multi:
+        return (status, matched, confidence, duration, template_paths[best])
     return (status, matched, confidence, duration)
 
 
@@ -95,6 +1346,11 @@ def cactus(
     crop: int = 0,
     enable_denoising: bool = False,
     acceleration: int = 2,
+    template: PreparedTemplate = None,
+    frame_cache: FrameCache = None,
+    decode_scale: int = 1,
+    tiles: int = 0,
+    full_confidence: bool = False,
 ) -> tuple:
     """
     图像差异检测函数（支持区域裁剪、加速和降噪控制）
@@ -109,12 +1365,20 @@ def cactus(
           =0 不裁剪
     enable_denoising: 是否启用降噪处理，默认关闭
     acceleration: 加速倍数 (1=原始, 2=2倍加速, 4=4倍加速)，默认2倍
+    template: 预处理模板（已裁剪、下采样），提供时不再读取 template_path
+    frame_cache: 子文件夹帧缓存，提供时经由缓存读取图片
+    decode_scale: 解码倍数 (1/2/4/8)，>1 时图片与模板均直接按 1/N 分辨率解码，
+                  acceleration 在此基础上继续下采样
+    tiles: 分块数，>1 时按行分为 tiles 块依次计算，已能确定是否超过阈值时提前结束，
+           matched 与整帧计算完全一致；默认为0整帧计算，启用降噪时始终整帧计算
+    full_confidence: 分块计算时是否仍计算全部分块，以返回整帧的差异百分比
 
     返回：
     (status, matched, confidence, duration)
     status: 状态码 ("PASS"/"EC01"/"EC02"/"EC03")
     matched: 是否检测到变化 (True/False)
-    confidence: 差异百分比（置信度）
+    confidence: 差异百分比（置信度）；分块计算提前结束时为None（未计算出整帧差异，
+                不写入部分结果；需要时设置 full_confidence）
     duration: 执行耗时
     """
     start_time = time.time()
@@ -124,71 +1388,61 @@ def cactus(
         not (0 <= threshold <= 100)
         or not (-99 <= crop <= 99)
         or acceleration not in [1, 2, 4]
+        or decode_scale not in (1, 2, 4, 8)
+        or not isinstance(tiles, int)
+        or tiles < 0
     ):
         duration = round(time.time() - start_time, 4)
         return ("EC01", False, 0.00, duration)
 
     # 安全读取图片
-    def _safe_read_grayscale(path):
-        try:
-            return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
-        except:
-            return None
-
-    img1 = _safe_read_grayscale(img_path)
-    img2 = _safe_read_grayscale(template_path)
+    mode = _gray_mode(decode_scale)
+    img1 = _read_frame(img_path, mode, frame_cache)
+    if template is None and template_path:
+        template = template_cache.get(
+            template_path, mode, crop, acceleration, frame_cache
+        )
 
     # 读取失败判断
-    if img1 is None or img2 is None:
+    if img1 is None or template is None:
         duration = round(time.time() - start_time, 4)
         return ("EC02", False, 0.00, duration)
 
-    # 执行裁剪操作
-    if crop != 0:
-        h, w = img1.shape[:2]
-        if crop > 0:
-            # 保留底部区域
-            new_h = max(1, int(h * (100 - crop) / 100))
-            img1 = img1[h - new_h : h, :]
-        else:
-            # 保留顶部区域
-            new_h = max(1, int(h * abs(crop) / 100))
-            img1 = img1[0:new_h, :]
-
-        # 对模板图片执行相同裁剪
-        h2, w2 = img2.shape[:2]
-        if crop > 0:
-            # 保留底部区域
-            new_h2 = max(1, int(h2 * (100 - crop) / 100))
-            img2 = img2[h2 - new_h2 : h2, :]
-        else:
-            # 保留顶部区域
-            new_h2 = max(1, int(h2 * abs(crop) / 100))
-            img2 = img2[0:new_h2, :]
-
-    # 图像尺寸校验
-    if img1.shape != img2.shape:
+    # 执行裁剪操作（模板已按相同比例裁剪）
+    with tracer.span("preprocess"):
+        img1 = _crop_image(img1, crop)
+
+        # 图像尺寸校验
+        if img1.shape != template.shape:
+            duration = round(time.time() - start_time, 4)
+            return ("EC03", False, 0.00, duration)
+
+        # 下采样加速（模板已预先下采样）
+        if acceleration > 1:
+            new_h, new_w = img1.shape[0] // acceleration, img1.shape[1] // acceleration
+            img1 = cv2.resize(img1, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    img2 = template.gray
+
+    # 分块计算，能确定结果时提前结束
+    if tiles > 1 and not enable_denoising and not full_confidence:
+        with tracer.span("compute", tiles=tiles):
+            matched, confidence = _cactus_tiled(img1, img2, threshold, tiles)
         duration = round(time.time() - start_time, 4)
-        return ("EC03", False, 0.00, duration)
-
-    # 下采样加速
-    if acceleration > 1:
-        new_h, new_w = img1.shape[0] // acceleration, img1.shape[1] // acceleration
-        img1 = cv2.resize(img1, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        img2 = cv2.resize(img2, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return ("PASS", matched, confidence, duration)
 
     # 计算绝对差异并二值化
-    abs_diff = cv2.absdiff(img1, img2)
-    _, diff_mask = cv2.threshold(abs_diff, 3, 255, cv2.THRESH_BINARY)
+    with tracer.span("compute"):
+        abs_diff = cv2.absdiff(img1, img2)
+        _, diff_mask = cv2.threshold(abs_diff, 3, 255, cv2.THRESH_BINARY)
 
-    # 可选的降噪处理
-    if enable_denoising:
-        kernel = np.ones((2, 2), np.uint8)
-        diff_mask = cv2.morphologyEx(diff_mask, cv2.MORPH_OPEN, kernel)
+        # 可选的降噪处理
+        if enable_denoising:
+            kernel = np.ones((2, 2), np.uint8)
+            diff_mask = cv2.morphologyEx(diff_mask, cv2.MORPH_OPEN, kernel)
 
-    # 计算变化百分比
-    changed_percentage = np.count_nonzero(diff_mask) / diff_mask.size * 100
-    confidence = round(changed_percentage, 2)
+        # 计算变化百分比
+        changed_percentage = np.count_nonzero(diff_mask) / diff_mask.size * 100
+        confidence = round(changed_percentage, 2)
 
     # 判断是否超过阈值
     matched = confidence >= threshold
@@ -199,12 +1453,158 @@ def cactus(
     return (status, matched, confidence, duration)
 
 
+def _cactus_tiled(img1, img2, threshold: float, tiles: int) -> tuple:
+    """
+    按行分块计算差异百分比，已计算部分足以确定是否超过阈值时提前结束
+
+    每块计算后得到整帧差异百分比的上下限：下限（按四舍五入后的精度）已不低于阈值，
+    或上限已低于阈值时即可确定结果，四舍五入单调，与整帧计算的判断完全一致。
+
+    参数:
+        img1, img2: 尺寸相同的灰度图（待检测图片与模板）
+        threshold: 差异百分比阈值
+        tiles: 分块数
+
+    返回:
+        (matched, confidence): 是否超过阈值，整帧差异百分比（保留两位小数）；
+        提前结束时只知道上下限，confidence 为None
+    """
+    height = img1.shape[0]
+    total = img1.size
+    changed = 0
+    bounds = np.linspace(0, height, min(tiles, height) + 1, dtype=int)
+    for top, bottom in zip(bounds[:-1], bounds[1:]):
+        abs_diff = cv2.absdiff(img1[top:bottom], img2[top:bottom])
+        _, diff_mask = cv2.threshold(abs_diff, 3, 255, cv2.THRESH_BINARY)
+        changed += np.count_nonzero(diff_mask)
+        remaining = (height - bottom) * img1.shape[1]
+        lower = round(changed / total * 100, 2)
+        upper = round((changed + remaining) / total * 100, 2)
+        if bottom < height and (lower >= threshold or upper < threshold):
+            return lower >= threshold, None
+    confidence = round(changed / total * 100, 2)
+    return confidence >= threshold, confidence
+
+
+# 仙人掌批量版：一次计算多张连续图片的差异占比
+def cactus_batch(
+    img_paths: list,
+    template_path: str,
+    threshold: float = 3.2,
+    crop: int = 0,
+    enable_denoising: bool = False,
+    acceleration: int = 2,
+    template: PreparedTemplate = None,
+    frame_cache: FrameCache = None,
+    decode_scale: int = 1,
+    tiles: int = 0,
+    full_confidence: bool = False,
+) -> list:
+    """
+    图像差异检测批量函数，结果与逐张调用 cactus 完全一致
+
+    每张图片的读取、裁剪、下采样与 cactus 相同；堆叠为一个数组后，
+    差异、二值化与计数合并为一次向量化计算。
+
+    参数：
+    img_paths: 待检测图片路径列表（通常为连续帧）
+    其余参数与 cactus 相同；批量计算始终整帧计算，tiles、full_confidence 不生效
+
+    返回：
+    与 img_paths 一一对应的 (status, matched, confidence, duration) 列表，
+    duration 为批量耗时的平均值
+    """
+    start_time = time.time()
+    count = len(img_paths)
+
+    # 参数校验
+    if (
+        not (0 <= threshold <= 100)
+        or not (-99 <= crop <= 99)
+        or acceleration not in [1, 2, 4]
+        or decode_scale not in (1, 2, 4, 8)
+    ):
+        duration = round((time.time() - start_time) / max(count, 1), 4)
+        return [("EC01", False, 0.00, duration)] * count
+
+    mode = _gray_mode(decode_scale)
+    if template is None and template_path:
+        template = template_cache.get(
+            template_path, mode, crop, acceleration, frame_cache
+        )
+
+    # 逐张读取、裁剪、下采样，失败的图片单独记录状态码
+    statuses = [None] * count
+    frames = []
+    frame_indices = []
+    for k, img_path in enumerate(img_paths):
+        img = _read_frame(img_path, mode, frame_cache)
+        if img is None or template is None:
+            statuses[k] = "EC02"
+            continue
+        with tracer.span("preprocess"):
+            img = _crop_image(img, crop)
+            if img.shape != template.shape:
+                statuses[k] = "EC03"
+                continue
+            if acceleration > 1:
+                new_h = img.shape[0] // acceleration
+                new_w = img.shape[1] // acceleration
+                img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        frames.append(img)
+        frame_indices.append(k)
+
+    # 向量化计算：|img - template| > 3 与 absdiff + threshold(3) 等价
+    changed_counts = []
+    with tracer.span("compute"):
+        if frames:
+            stack = np.stack(frames)
+            tmpl = template.gray
+            diff_mask = (np.maximum(stack, tmpl) - np.minimum(stack, tmpl)) > 3
+            if enable_denoising:
+                # 开运算须逐帧进行，避免跨帧边界
+                kernel = np.ones((2, 2), np.uint8)
+                changed_counts = [
+                    np.count_nonzero(
+                        cv2.morphologyEx(mask.view(np.uint8), cv2.MORPH_OPEN, kernel)
+                    )
+                    for mask in diff_mask
+                ]
+            else:
+                changed_counts = np.count_nonzero(
+                    diff_mask.reshape(len(frames), -1), axis=1
+                ).tolist()
+
+    duration = round((time.time() - start_time) / max(count, 1), 4)
+    results = [(status, False, 0.00, duration) for status in statuses]
+    for k, changed in zip(frame_indices, changed_counts):
+        changed_percentage = int(changed) / template.gray.size * 100
+        confidence = round(changed_percentage, 2)
+        results[k] = ("PASS", confidence >= threshold, confidence, duration)
+    return results
+
+
 # 三叶草：识别圆圈（不推荐）
 
 
-def blover(img_path, template_path=None, threshold: int = 1, crop: int = 0):
+def blover(
+    img_path,
+    template_path=None,
+    threshold: int = 1,
+    crop: int = 0,
+    frame_cache: FrameCache = None,
+    decode_scale: int = 1,
+    roi: list = None,
+    downscale: int = 1,
+    dp: float = 1,
+    min_dist: float = 100,
+    param1: float = 90,
+    param2: float = None,
+    min_radius: int = 20,
+    max_radius: int = 25,
+):
     """
-    模板匹配检测函数（支持区域裁剪）
+    圆圈检测函数（支持区域裁剪、矩形检测区域和降分辨率检测）
 
     参数：
     img_path: 待检测图片路径
@@ -213,6 +1613,18 @@ def blover(img_path, template_path=None, threshold: int = 1, crop: int = 0):
           >0 从底部向上裁剪，保留底部
           <0 从顶部向下裁剪，保留顶部
           =0 不裁剪
+    frame_cache: 子文件夹帧缓存，提供时经由缓存读取图片
+    decode_scale: 解码倍数 (1/2/4/8)，>1 时直接按 1/N 分辨率解码，圆半径等参数同比缩放
+    roi: 矩形检测区域 [x, y, w, h]（原始分辨率像素坐标），默认为None检测整张图片；
+         先取检测区域再按 crop 裁剪，超出图片的部分自动截去
+    downscale: 检测前再缩小的倍数 (1/2/4/8)，与 decode_scale 叠加，圆半径等参数同比缩放
+    dp: 图像分辨率与累加器分辨率之比（1 保持原始分辨率，值越大检测越粗糙）
+    min_dist: 圆心间最小距离（原始分辨率像素，防止重叠圆检测，需根据目标间距调整）
+    param1: Canny 边缘检测高阈值（值越大边缘检测要求越严格，建议 50~150）
+    param2: 圆心累加器阈值（值越小检测越宽松，假圆越多，建议 10~50），按配置值直接使用；
+            默认为None时取 32，降分辨率解码、缩小后按缩放倍数的平方根放宽
+    min_radius: 目标最小半径（原始分辨率像素）
+    max_radius: 目标最大半径（原始分辨率像素）
 
     返回：
     (status（正常返回PASS）, matched（True/False，圆数量是否等于threshold）, confidence（检测到的圆圈数量）, duration)
@@ -226,55 +1638,342 @@ def blover(img_path, template_path=None, threshold: int = 1, crop: int = 0):
     if not isinstance(crop, int) or crop < -99 or crop > 99:
         return ("EB01", False, 0, time.time() - start_time)
 
-    # 安全读取图片为灰度图
-    try:
-        gray = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
-        if gray is None:
-            return ("EB02", False, 0, time.time() - start_time)
-    except Exception as e:
-        return ("EB02", False, 0, time.time() - start_time)
+    if decode_scale not in (1, 2, 4, 8) or downscale not in (1, 2, 4, 8):
+        return ("EB01", False, 0, time.time() - start_time)
 
-    # 执行裁剪
-    if crop != 0:
-        h, w = gray.shape[:2]
-        if crop > 0:
-            # 保留底部区域
-            new_h = max(1, int(h * (100 - crop) / 100))
-            gray = gray[h - new_h : h, :]
-        else:
-            # 保留顶部区域
-            new_h = max(1, int(h * abs(crop) / 100))
-            gray = gray[0:new_h, :]
-
-    # 预处理以减少噪声
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-
-    # 应用霍夫圆变换
-    circlEB = cv2.HoughCircles(
-        blur,
-        cv2.HOUGH_GRADIENT,
-        dp=1,  # 图像分辨率与累加器分辨率之比（1:1保持原始分辨率，值越大检测越粗糙）
-        minDist=100,  # 圆心间最小距离（防止重叠圆检测，需根据目标间距调整）
-        param1=90,  # Canny边缘检测高阈值（值越大边缘检测要求越严格，建议50-150）
-        param2=32,  # 圆心累加器阈值（值越小检测越宽松，假圆越多，建议10-50）
-        minRadius=20,  # 目标最小半径（根据实际目标尺寸设置下限）
-        maxRadius=25,  # 目标最大半径（根据实际目标尺寸设置上限）
-    )
+    # 未配置累加器阈值时：圆周缩小后票数减少，按经验以缩放倍数的平方根放宽默认值
+    if param2 is None:
+        param2 = max(1, round(32 / (decode_scale * downscale) ** 0.5))
 
-    # 计算结果
-    confidence = 0
-    if circlEB is not None:
-        confidence = len(circlEB[0])
+    hough_params = (dp, min_dist, param1, param2)
+    if not all(isinstance(value, (int, float)) and value > 0 for value in hough_params):
+        return ("EB01", False, 0, time.time() - start_time)
 
-    # 判断是否匹配
-    # matched = confidence == threshold
-    matched = confidence >= threshold
+    radii = (min_radius, max_radius)
+    if not all(isinstance(value, int) for value in radii) or not (
+        0 <= min_radius <= max_radius
+    ):
+        return ("EB01", False, 0, time.time() - start_time)
+
+    if roi is not None and (
+        not isinstance(roi, (list, tuple))
+        or len(roi) != 4
+        or not all(isinstance(value, int) for value in roi)
+    ):
+        return ("EB01", False, 0, time.time() - start_time)
+
+    # 安全读取图片为灰度图
+    gray = _read_frame(img_path, _gray_mode(decode_scale), frame_cache)
+    if gray is None:
+        return ("EB02", False, 0, time.time() - start_time)
+
+    # 取检测区域、执行裁剪
+    with tracer.span("preprocess"):
+        if roi is not None:
+            x, y, w, h = (value // decode_scale for value in roi)
+            gray = gray[max(0, y) : max(0, y + h), max(0, x) : max(0, x + w)]
+            if gray.size == 0:  # 检测区域不在图片内
+                return ("EB01", False, 0, time.time() - start_time)
+
+        gray = _crop_image(gray, crop)
+
+        # 检测前再缩小（检测区域较小时开销很低）
+        if downscale > 1:
+            h, w = gray.shape[:2]
+            size = (max(1, w // downscale), max(1, h // downscale))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+        # 预处理以减少噪声
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # 应用霍夫圆变换（参数按原始分辨率设定，降分辨率解码、缩小时同比缩放）
+    scale = decode_scale * downscale
+    with tracer.span("compute"):
+        circlEB = cv2.HoughCircles(
+            blur,
+            cv2.HOUGH_GRADIENT,
+            dp=dp,  # 图像分辨率与累加器分辨率之比
+            minDist=min_dist / scale,  # 圆心间最小距离
+            param1=param1,  # Canny边缘检测高阈值
+            param2=param2,  # 圆心累加器阈值
+            minRadius=min_radius // scale,  # 目标最小半径
+            maxRadius=-(-max_radius // scale),  # 目标最大半径，向上取整
+        )
+
+        # 计算结果
+        confidence = 0
+        if circlEB is not None:
+            confidence = len(circlEB[0])
+
+    # 判断是否匹配
+    # matched = confidence == threshold
+    matched = confidence >= threshold
 
     duration = time.time() - start_time
 
     return ("PASS", matched, confidence, duration)
 
 
+# 检测器注册表：任务类型 -> 检测函数
+DETECTORS = {"cattail": cattail, "blover": blover, "cactus": cactus}
+
+# 支持批量检测的检测函数 -> 批量函数
+BATCH_DETECTORS = {cactus: cactus_batch}
+
+# 检测器专属参数：编译时绑定到 PreparedDetector，不经由 trails 传递
+DETECTOR_PARAMS = (
+    "acceleration",
+    "enable_denoising",
+    "decode_scale",
+    "pyramid_levels",
+    "roi",
+    "downscale",
+    "dp",
+    "min_dist",
+    "param1",
+    "param2",
+    "min_radius",
+    "max_radius",
+    "tiles",
+    "full_confidence",
+)
+
+
+class PreparedDetector:
+    """
+    编译后的检测任务：绑定检测函数与预处理模板，所有子文件夹线程共享
+
+    调用方式与检测函数相同；传入的 template_path 与编译时一致（或未传入）时，
+    直接使用预处理模板，不再读取模板文件。
+
+    参数:
+        func: 检测函数（cattail / cactus / blover）
+        template_path: 模板图片路径（cattail 可为路径列表），cactus 可为None（运行时使用首帧）
+        crop: 裁剪比例，cactus 模板按相同比例预裁剪
+        **detector_kwargs: 检测器专属参数（见 DETECTOR_PARAMS），每次调用时传入；
+            模板按其中的 acceleration、decode_scale 预下采样
+    """
+
+    def __init__(self, func, template_path=None, crop=0, **detector_kwargs):
+        self.func = func
+        self.__name__ = func.__name__
+        self.template_path = template_path
+        self.template = None
+        self.coarse_template = None
+        self.reused = 0  # 每次调用复用的模板数（编译时模板 + 粗匹配模板）
+        self.batch_func = BATCH_DETECTORS.get(func)  # 不支持批量检测时为None
+
+        # 只绑定检测函数支持的参数
+        accepted = inspect.signature(func).parameters
+        self.kwargs = {k: v for k, v in detector_kwargs.items() if k in accepted}
+        acceleration = self.kwargs.get("acceleration", 2)
+        decode_scale = self.kwargs.get("decode_scale", 1)
+
+        # 待检测图片的解码方式（供帧预取使用），参数无效时为None
+        self.decode_mode = None
+        if decode_scale in (1, 2, 4, 8):
+            if func is cattail and decode_scale == 1:
+                self.decode_mode = "bgr2gray"
+            else:
+                self.decode_mode = _gray_mode(decode_scale)
+
+        if template_path and self.decode_mode:
+            if func is cattail and isinstance(template_path, list):
+                self.template = [
+                    template_cache.get(path, self.decode_mode) for path in template_path
+                ]
+            elif func is cattail:
+                self.template = template_cache.get(template_path, self.decode_mode)
+            elif func is cactus:
+                self.template = template_cache.get(
+                    template_path, self.decode_mode, crop, acceleration
+                )
+
+        # cattail 金字塔粗匹配模板同样在编译时准备，层数与 cattail 按模板尺寸减少后一致
+        templates = (
+            self.template if isinstance(self.template, list) else [self.template]
+        )
+        if self.template is not None:
+            self.reused = len(templates)
+        levels = self.kwargs.get("pyramid_levels", 0)
+        if func is cattail and levels in (1, 2, 3) and None not in templates:
+            levels = _pyramid_levels(templates, levels)
+            if levels > 0:
+                paths = template_path if isinstance(template_path, list) else None
+                coarse = [
+                    template_cache.get(path, self.decode_mode, 0, 2**levels)
+                    for path in (paths or [template_path])
+                ]
+                if None not in coarse:
+                    self.coarse_template = coarse if paths else coarse[0]
+                    self.reused += len(coarse)
+
+    def __call__(self, img_path, template_path=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        if self.template is not None and template_path in (None, self.template_path):
+            kwargs["template"] = self.template
+            if self.coarse_template is not None:
+                kwargs["coarse_template"] = self.coarse_template
+            template_cache.reuse(self.reused)
+        return self.func(
+            img_path=img_path,
+            template_path=template_path or self.template_path,
+            **kwargs,
+        )
+
+    def batch(self, img_paths, template_path=None, **kwargs):
+        """批量检测（仅 batch_func 不为None时可用），返回结果列表"""
+        kwargs = {**self.kwargs, **kwargs}
+        if self.template is not None and template_path in (None, self.template_path):
+            kwargs["template"] = self.template
+            template_cache.reuse(self.reused * len(img_paths))
+        return self.batch_func(
+            img_paths=img_paths,
+            template_path=template_path or self.template_path,
+            **kwargs,
+        )
+
+
+def compile_task(task_kwargs):
+    """
+    将单个任务配置编译为 PreparedDetector
+
+    参数:
+        task_kwargs: 任务参数字典（gate_from_yaml 解析结果）
+
+    返回:
+        PreparedDetector 实例
+    """
+    task_type = task_kwargs.get("task_type")
+    detector_func = DETECTORS.get(task_type)
+    if detector_func is None:
+        print(f"🟠 【警告】未知的任务类型 {task_type}，默认使用 cattail")
+        detector_func = cattail
+
+    return PreparedDetector(
+        detector_func,
+        template_path=task_kwargs.get("template_path"),
+        crop=task_kwargs.get("crop", 0),
+        **{k: task_kwargs[k] for k in DETECTOR_PARAMS if k in task_kwargs},
+    )
+
+
+class _TrailsStop(Exception):
+    """trails 内部信号：检测出错或达到循环限制时终止搜索"""
+
+    def __init__(self, status, result=None):
+        super().__init__(status)
+        self.status = status
+        self.result = result
+
+
+def _find_edge(probe, lo, hi, target, max_stride=0):
+    """
+    在 [lo, hi) 内查找第一个 probe(i) == target 的索引（假设区间内状态只变化一次）
+
+    先以倍增步长试探（galloping），命中后在上一次未命中与本次命中之间二分查找。
+
+    参数:
+        probe: 检测函数，输入索引返回是否匹配
+        lo, hi: 搜索区间 [lo, hi)
+        target: 目标状态（True 查找出现，False 查找消失）
+        max_stride: 试探步长上限，0 表示不限制
+
+    返回:
+        边界索引，未找到返回None
+    """
+    prev, i, stride = lo - 1, lo, 1
+    while i < hi:
+        if probe(i) == target:
+            # 在 (prev, i] 内二分查找边界
+            left, right = prev + 1, i
+            while left < right:
+                mid = (left + right) // 2
+                if probe(mid) == target:
+                    right = mid
+                else:
+                    left = mid + 1
+            return left
+        if i == hi - 1:
+            break
+        prev = i
+        i = min(i + stride, hi - 1)  # 保证最后一帧一定被试探
+        stride = stride * 2 if not max_stride else min(stride * 2, max_stride)
+    return None
+
+
+def _find_edge_back(probe, lo, hi, target, max_stride=0):
+    """
+    在 [lo, hi) 内查找最后一个 probe(i) == target 的索引（假设区间内状态只变化一次）
+
+    与 _find_edge 对称：从 hi-1 向前倍增试探，命中后二分查找。
+
+    参数:
+        probe: 检测函数，输入索引返回是否匹配
+        lo, hi: 搜索区间 [lo, hi)
+        target: 目标状态
+        max_stride: 试探步长上限，0 表示不限制
+
+    返回:
+        边界索引，未找到返回None
+    """
+    prev, i, stride = hi, hi - 1, 1
+    while i >= lo:
+        if probe(i) == target:
+            # 在 [i, prev) 内二分查找边界
+            left, right = i, prev - 1
+            while left < right:
+                mid = (left + right + 1) // 2
+                if probe(mid) == target:
+                    left = mid
+                else:
+                    right = mid - 1
+            return left
+        if i == lo:
+            break
+        prev = i
+        i = max(i - stride, lo)  # 保证第一帧一定被试探
+        stride = stride * 2 if not max_stride else min(stride * 2, max_stride)
+    return None
+
+
+class OffsetPrior:
+    """
+    各任务匹配位置的运行分布，所有子文件夹共享
+
+    同一批次的子文件夹是同一场景的多次录制，同一任务的匹配帧在剩余图片中的偏移量相近，
+    已完成子文件夹的偏移量中位数作为后续子文件夹的搜索起点。
+
+    参数:
+        offsets: 偏移量存储 {任务序号: [偏移量, ...]}，进程池模式下传入 Manager 字典
+        lock: 锁，进程池模式下传入 Manager 锁
+    """
+
+    def __init__(self, offsets=None, lock=None):
+        self.offsets = {} if offsets is None else offsets
+        self.lock = threading.Lock() if lock is None else lock
+
+    def record(self, task_idx, offset):
+        """记录一次匹配偏移量"""
+        with self.lock:
+            # 整体赋值而非 append，兼容 Manager 字典
+            self.offsets[task_idx] = self.offsets.get(task_idx, []) + [offset]
+
+    def expected(self, task_idx):
+        """返回期望偏移量（中位数），尚无样本时返回None"""
+        with self.lock:
+            values = list(self.offsets.get(task_idx, []))
+        if not values:
+            return None
+        return int(np.median(values))
+
+    def summary(self) -> dict:
+        """返回 {任务序号: (期望偏移量, 样本数)}"""
+        with self.lock:
+            items = {k: list(v) for k, v in self.offsets.items()}
+        return {k: (int(np.median(v)), len(v)) for k, v in items.items()}
+
+
 # 核心逻辑调度
 def trails(
     image_files,
@@ -287,6 +1986,13 @@ def trails(
     detector_func=None,  # New parameter to specify which detector function to use
     limit=0,  # Maximum loop count limit, 0 means no limit
     debug=False,  # Debug mode switch
+    frame_cache=None,  # Per-subfolder decoded frame cache
+    search="leap",  # Search strategy: "leap" or "bisect"
+    stats=None,  # Optional dict receiving search statistics
+    hint=None,  # Expected match offset from finished subfolders
+    prefetcher=None,  # Background frame prefetcher
+    batch=0,  # Frames per batched detector call in leap=1 mode
+    speculator=None,  # Speculative window evaluating upcoming candidates in parallel
 ):
     """
     处理提供的图片列表，通过设置跳跃间隔进行模板匹配检查
@@ -303,6 +2009,22 @@ def trails(
         crop: 图像裁剪比例，默认为0
         detector_func: 检测器函数，默认为None时使用cattail
         limit: 最大循环次数限制，默认为0表示不限制，必须为非负整数
+        frame_cache: 子文件夹帧缓存（FrameCache），默认为None表示不缓存
+        search: 搜索策略，默认为"leap"
+              - "leap": 按 leap 间隔跳帧，命中后回退逐帧检查
+              - "bisect": 倍增试探+二分查找出现（fade时再查找消失）边界，
+                假设每个边界前后状态只变化一次，检测次数为 O(log n)
+        stats: 统计字典，提供时写入 "evaluated"（实际检测帧数）
+        hint: 期望匹配位置（OffsetPrior 提供），默认为None表示从头搜索
+              提供时从该位置向两侧扩展搜索，均未匹配时回退到完整扫描；
+              对只变化一次的序列，结果与完整扫描一致
+        prefetcher: 帧预取器（FramePrefetcher），默认为None表示不预取；
+              提供时替代 frame_cache 读取，跳帧模式下按 leap 预取后续候选帧
+        batch: 逐帧检查（leap=1）时每次批量检测的帧数，默认为0表示不批量；
+              仅对支持批量检测的检测器（cactus）生效，结果与逐张检测一致
+        speculator: 推测检测窗口（SpeculativeWindow），默认为None表示逐个检测；
+              有空闲名额时并行检测之后的候选帧，结果按原顺序使用，
+              与逐个检测完全一致（仅 leap 搜索）
 
     返回值:
         元组 (status, matched_file, result):
@@ -317,104 +2039,371 @@ def trails(
         detector_func = cattail
 
     # 仙人掌特殊处理：如果没有模板且是cactus函数，使用第一张图片作为模板
-    if detector_func == cactus and template_path is None and len(image_files) > 0:
+    base_func = getattr(detector_func, "func", detector_func)
+    if (
+        base_func is cactus
+        and template_path is None
+        and getattr(detector_func, "template_path", None) is None
+        and len(image_files) > 0
+    ):
         template_path = os.path.join(folder_path, image_files[0])
         print(f"🌵【cactus】使用第一张图片作为模板: {image_files[0]}")
 
-    i = leap - 1  # 起始索引（对应第leap张图片）
-    waiting_for_fade = False  # 是否在等待匹配消失
-    first_match = None  # 第一个匹配的图片
-    result_found = False  # 是否找到结果
-    result = None  # 初始化result变量
-    loop_count = 0  # 循环计数器
-
-    trails_status = "PASS"  # 返回状态
-    trails_matched = None  # 返回文件名
-
-    while i < len(image_files):
-        # 检查是否达到循环次数限制
-        if limit and loop_count >= limit:
-            trails_status = "LIMITED"
-            result = None
-            return (trails_status, trails_matched, result)
+    # 模板只读取、预处理一次：未编译的检测函数、cactus 以首帧为模板时在此编译
+    if base_func in DETECTORS.values() and (
+        detector_func is base_func
+        or template_path not in (None, detector_func.template_path)
+    ):
+        detector_func = PreparedDetector(
+            base_func, template_path, crop, **getattr(detector_func, "kwargs", {})
+        )
 
-        loop_count += 1  # 增加循环计数
-        img_file = image_files[i]
+    # 准备调用检测器函数的参数
+    detector_kwargs = {
+        "template_path": template_path,
+        "crop": crop,
+    }
+
+    # 只有在明确提供threshold时才传递
+    if threshold is not None:
+        detector_kwargs["threshold"] = threshold
+    if prefetcher is not None:
+        detector_kwargs["frame_cache"] = prefetcher
+    elif frame_cache is not None:
+        detector_kwargs["frame_cache"] = frame_cache
+
+    def evaluate(img_file):
+        """对单张图片调用检测函数（可在协助线程中执行）"""
         img_path = os.path.join(folder_path, img_file)
+        start = time.perf_counter()
+        with tracer.span("frame", file=img_file):
+            result = detector_func(img_path=img_path, **detector_kwargs)
+        metrics.inc(
+            "perfgarden_detector_seconds_total",
+            time.perf_counter() - start,
+            task=detector_func.__name__,
+        )
+        return result
 
-        # 准备调用检测器函数的参数
-        detector_kwargs = {
-            "img_path": img_path,
-            "template_path": template_path,
-            "crop": crop,
-        }
-
-        # 只有在明确提供threshold时才传递
-        if threshold is not None:
-            detector_kwargs["threshold"] = threshold
-
-        result = detector_func(**detector_kwargs)  # 使用指定的检测函数
+    def detect(img_file, loop_count, result=None):
+        """对单张图片调用检测函数，result 为批量检测、协助线程已得到的结果"""
+        if result is None:
+            result = evaluate(img_file)
+        metrics.inc("perfgarden_detector_calls_total", task=detector_func.__name__)
+        if stats is not None:
+            stats["evaluated"] = stats.get("evaluated", 0) + 1
 
         if debug:  # 详细调试日志
-            status, matched, confidence, duration = result
+            status, matched, confidence, duration = result[:4]
             match_status = "✅ TRUE" if matched else "❌ FALSE"
             detector_name = detector_func.__name__
             print(
                 f"【调试：{detector_name}】{img_file} | 状态:{status} | {match_status} | 阈值:{confidence} | 耗时:{duration}s | 循环:{loop_count}"
             )
+        return result
+
+    # 只有已编译的检测器知道解码方式，才能预取
+    prefetch_mode = getattr(detector_func, "decode_mode", None)
+    if prefetch_mode is None:
+        prefetcher = None
+        detector_kwargs.pop("frame_cache", None)
+        if frame_cache is not None:
+            detector_kwargs["frame_cache"] = frame_cache
+
+    # 批量检测：逐帧检查时一次检测 batch 张连续图片，结果按索引暂存
+    batch_size = batch if getattr(detector_func, "batch_func", None) else 0
+    batch_results = {}
+
+    # 推测检测：之后候选帧的检测结果（Future）按索引暂存；
+    # 同一帧的检测结果与何时检测无关，回跳后仍可直接使用。
+    # trails 返回时取消尚未开始的推测检测，已开始的检测结果直接丢弃
+    speculated = {}
+
+    if hint is not None and len(image_files) > 0:
+        return _trails_guided(image_files, detect, leap, fade, limit, search, hint)
+    if search == "bisect":
+        return _trails_bisect(image_files, detect, leap, fade, limit)
 
-        # 解包结果元组
-        status, matched, confidence, duration = result
+    try:
+        i = leap - 1  # 起始索引（对应第leap张图片）
+        waiting_for_fade = False  # 是否在等待匹配消失
+        first_match = None  # 第一个匹配的图片
+        result_found = False  # 是否找到结果
+        result = None  # 初始化result变量
+        loop_count = 0  # 循环计数器
+
+        trails_status = "PASS"  # 返回状态
+        trails_matched = None  # 返回文件名
+
+        while i < len(image_files):
+            # 检查是否达到循环次数限制
+            if limit and loop_count >= limit:
+                trails_status = "LIMITED"
+                result = None
+                return (trails_status, trails_matched, result)
+
+            loop_count += 1  # 增加循环计数
+            img_file = image_files[i]
+
+            # 预取当前帧之后的候选帧（回跳、切换步长后旧候选自动失效）
+            if prefetcher is not None:
+                candidates = range(i, len(image_files), leap)
+                prefetcher.schedule(
+                    [
+                        os.path.join(folder_path, image_files[j])
+                        for j in candidates[: prefetcher.depth + 1]
+                    ],
+                    prefetch_mode,
+                )
 
-        # 验证status，如果不是PASS则结束任务
-        if status != "PASS":
-            # print(f"/n任务结束，错误代码: {status}")
-            trails_status = "ERROR"
-            return (trails_status, trails_matched, result)
+            if batch_size > 1 and leap == 1 and i not in batch_results:
+                end = len(image_files)
+                if limit:
+                    end = min(end, i + limit - loop_count + 1)  # 不超出循环限制
+                end = min(end, i + batch_size)
+                batch_paths = [os.path.join(folder_path, f) for f in image_files[i:end]]
+                batch_start = time.perf_counter()
+                with tracer.span("batch", file=image_files[i], count=len(batch_paths)):
+                    batch_output = detector_func.batch(batch_paths, **detector_kwargs)
+                metrics.inc(
+                    "perfgarden_detector_seconds_total",
+                    time.perf_counter() - batch_start,
+                    task=detector_func.__name__,
+                )
+                for offset, batch_result in enumerate(batch_output):
+                    batch_results[i + offset] = batch_result
+            elif (
+                speculator is not None
+                and i not in batch_results
+                and i not in speculated
+            ):
+                ahead = range(i + leap, len(image_files), leap)
+                if limit:
+                    ahead = ahead[: max(0, limit - loop_count)]
+                ahead = [j for j in ahead if j not in speculated]
+                for j in ahead[: speculator.acquire(len(ahead))]:
+                    speculated[j] = speculator.submit(evaluate, image_files[j])
+
+            ready = batch_results.pop(i, None)
+            if i in speculated:
+                ready = speculated.pop(i).result()
+            result = detect(img_file, loop_count, ready)
+
+            # 解包结果元组（多模板 cattail 另有第五项匹配模板）
+            status, matched, confidence, duration = result[:4]
+
+            # 验证status，如果不是PASS则结束任务
+            if status != "PASS":
+                # print(f"/n任务结束，错误代码: {status}")
+                trails_status = "ERROR"
+                return (trails_status, trails_matched, result)
+
+            if leap == 1:  # 在逐个检查模式
+                if waiting_for_fade:  # 已经找到匹配，等待消失
+                    if not matched:  # 匹配消失
+                        # print(f"/n在 {img_file} 消失")
+                        result_found = True
+                        trails_matched = img_file
+                        break
+                elif matched:  # 找到匹配
+                    if not fade:  # 标准模式，找到匹配就结束
+                        # print(f"/n在 {img_file} 出现")
+                        result_found = True
+                        trails_matched = img_file
+                        break
+                    else:  # fade模式，记录并继续
+                        waiting_for_fade = True
+                        first_match = img_file
+            else:  # 在跳跃模式
+                if matched:
+                    # 回退并开始逐个检查
+                    i = max(0, i - (leap - 1))  # 回退leap-1张图片
+                    if debug:
+                        print(
+                            f"【调试：智能跳帧】当前 leap: {leap}，检测到目标！回跳至 {image_files[i]} 逐帧检查"
+                        )
+                    leap = 1  # 设置步长为1
+                    continue
 
-        if leap == 1:  # 在逐个检查模式
-            if waiting_for_fade:  # 已经找到匹配，等待消失
-                if not matched:  # 匹配消失
-                    # print(f"/n在 {img_file} 消失")
-                    result_found = True
-                    trails_matched = img_file
-                    break
-            elif matched:  # 找到匹配
-                if not fade:  # 标准模式，找到匹配就结束
-                    # print(f"/n在 {img_file} 出现")
-                    result_found = True
-                    trails_matched = img_file
-                    break
-                else:  # fade模式，记录并继续
-                    waiting_for_fade = True
-                    first_match = img_file
-        else:  # 在跳跃模式
-            if matched:
-                # 回退并开始逐个检查
-                i = max(0, i - (leap - 1))  # 回退leap-1张图片
-                if debug:
-                    print(
-                        f"【调试：智能跳帧】当前 leap: {leap}，检测到目标！回跳至 {image_files[i]} 逐帧检查"
-                    )
-                leap = 1  # 设置步长为1
-                continue
+            i += leap  # 继续检查
 
-        i += leap  # 继续检查
+        # 如果所有都没有找到结果，输出UNFOUND
+        if not result_found:
+            # print("/nUNFOUND")
+            trails_status = "UNFOUND"
+            result = None
+            return (trails_status, trails_matched, result)
 
-    # 如果所有都没有找到结果，输出UNFOUND
-    if not result_found:
-        # print("/nUNFOUND")
-        trails_status = "UNFOUND"
-        result = None
+        # 输出总耗时
+        total_duration = time.time() - start_time
+        # print(f"/n总耗时: {total_duration:.2f} 秒")
         return (trails_status, trails_matched, result)
+    finally:
+        for future in speculated.values():
+            future.cancel()  # 取消后自动归还名额
+
+
+def _make_probe(image_files, detect, limit):
+    """
+    创建带结果缓存的单帧检测函数，供边界搜索策略使用
+
+    返回:
+        (probe, results): probe(i) 返回第 i 帧是否匹配；results 为 {索引: 检测结果}
+        检测出错或达到 limit 时抛出 _TrailsStop
+    """
+    results = {}  # 已检测帧的结果，搜索过程中不重复检测
+
+    def probe(i):
+        if i not in results:
+            if limit and len(results) >= limit:
+                raise _TrailsStop("LIMITED")
+            results[i] = detect(image_files[i], len(results) + 1)
+            if results[i][0] != "PASS":
+                raise _TrailsStop("ERROR", results[i])
+        return results[i][1]
+
+    return probe, results
+
+
+def _trails_bisect(image_files, detect, leap, fade, limit):
+    """
+    trails 的二分搜索策略：倍增试探+二分查找状态边界
+
+    - fade=False: 以不超过 leap 的步长找到匹配，再二分查找首个匹配帧
+    - fade=True: 同样先找到首个匹配帧，再倍增试探+二分查找匹配消失的帧
+      （假设消失后不再出现）
+
+    两种模式下查找出现边界的步长都不超过 leap：目标出现后还会消失（如按钮短暂显示）时，
+    不受限制的倍增步长会跳过整个可见区间而返回 UNFOUND。与智能跳帧相同，
+    假设目标持续不少于 leap 帧。
+
+    参数:
+        image_files: 已排序的图片文件名列表
+        detect: 单帧检测函数 detect(img_file, loop_count) -> 检测结果元组
+        leap: 查找出现边界时的最大试探步长
+        fade: 是否查找匹配消失的帧
+        limit: 最大检测次数限制，0 表示不限制
 
-    # 输出总耗时
-    total_duration = time.time() - start_time
-    # print(f"/n总耗时: {total_duration:.2f} 秒")
-    return (trails_status, trails_matched, result)
+    返回:
+        与 trails 相同的 (status, matched_file, result)
+    """
+    probe, results = _make_probe(image_files, detect, limit)
+
+    try:
+        edge = _find_edge(probe, 0, len(image_files), True, leap)
+        if edge is not None and fade:
+            edge = _find_edge(probe, edge + 1, len(image_files), False)
+    except _TrailsStop as stop:
+        return (stop.status, None, stop.result)
+
+    if edge is None:
+        return ("UNFOUND", None, None)
+    return ("PASS", image_files[edge], results[edge])
 
 
-def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
+def _trails_guided(image_files, detect, leap, fade, limit, search, hint):
+    """
+    trails 的先验引导策略：从期望位置开始，向两侧倍增扩展搜索
+
+    - fade=False: 期望位置已匹配则向前查找出现边界，否则向后查找；
+      向后未找到时回退扫描期望位置之前的图片
+    - fade=True: 检查期望消失位置的前一帧，仍匹配则向后查找消失边界；
+      未匹配则向前查找最后一个匹配帧（消失边界即其后一帧），
+      向前也未匹配说明目标尚未出现，向后依次查找出现、消失边界
+
+    查找出现边界的扩展步长不超过 leap（与智能跳帧的漏检假设一致，search 为 leap、
+    bisect 时相同），查找消失边界的步长不受限制。
+
+    参数:
+        image_files: 已排序的图片文件名列表
+        detect: 单帧检测函数 detect(img_file, loop_count) -> 检测结果元组
+        leap: 检查间隔
+        fade: 是否查找匹配消失的帧
+        limit: 最大检测次数限制，0 表示不限制
+        search: 搜索策略（"leap"/"bisect"）
+        hint: 期望匹配位置（在 image_files 中的索引）
+
+    返回:
+        与 trails 相同的 (status, matched_file, result)
+    """
+    probe, results = _make_probe(image_files, detect, limit)
+    n = len(image_files)
+
+    try:
+        if not fade:
+            h = min(max(hint, 0), n - 1)
+            if probe(h):
+                last_miss = _find_edge_back(probe, 0, h, False, leap)
+                edge = 0 if last_miss is None else last_miss + 1
+            else:
+                edge = _find_edge(probe, h + 1, n, True, leap)
+                if edge is None:  # 回退：扫描期望位置之前的图片
+                    edge = _find_edge(probe, 0, h, True, leap)
+        else:
+            h = min(max(hint - 1, 0), n - 1)
+            if probe(h):
+                edge = _find_edge(probe, h + 1, n, False)
+            else:
+                last_hit = _find_edge_back(probe, 0, h, True, leap)
+                if last_hit is not None:
+                    edge = last_hit + 1
+                else:  # 目标尚未出现
+                    edge = _find_edge(probe, h + 1, n, True, leap)
+                    if edge is not None:
+                        edge = _find_edge(probe, edge + 1, n, False)
+    except _TrailsStop as stop:
+        return (stop.status, None, stop.result)
+
+    if edge is None:
+        return ("UNFOUND", None, None)
+    return ("PASS", image_files[edge], results[edge])
+
+
+# 全局选项及默认值（YAML 顶层配置，与 path、max_threads 同级）
+GLOBAL_OPTIONS = {
+    "frame_cache_mb": 64,  # 每个子文件夹的帧缓存内存上限（MB），0 表示禁用
+    "executor": "thread",  # 并行方式：thread 线程池 / process 进程池
+    "prior": False,  # 是否以已完成子文件夹的匹配位置引导后续子文件夹的搜索
+    "video_label": "index",  # 视频帧标签：index 帧序号 / time 时间戳
+    "prefetch": 0,  # 跳帧模式下后台预取的候选帧数，0 表示禁用
+    "result_cache": True,  # 是否缓存结果，跳过未变化的子文件夹
+    "force": False,  # 是否忽略已有缓存，重新处理所有子文件夹
+    "thumbnail_index": 0,  # 缩略图索引倍数 (2/4/8)，0 表示不建立索引
+    "trace": "",  # 逐帧追踪输出文件（.json 为 Chrome trace，.jsonl 为逐行事件），空表示不追踪
+    "metrics_port": 0,  # 实时指标 HTTP 端口（本机 /metrics），0 表示不启动
+    "metrics_file": "",  # 实时指标 Prometheus 文本文件路径，空表示不写入
+    "metrics_interval": 5,  # 实时指标采样周期（秒）
+    "sinks": ["csv"],  # 结果输出：csv（汇总）、detail（明细）、jsonl、sqlite
+    "sink_flush_interval": 1,  # 结果写入磁盘的刷新间隔（秒）
+    "schedule": "size",  # 子文件夹提交顺序：size 帧数多的优先 / scan 扫描顺序
+    "speculate": 0,  # 跳帧搜索时同时检测的候选帧数（推测窗口宽度），0/1 表示逐个检测
+    "max_memory_mb": 0,  # 所有线程解码帧的内存上限（MB），超出时解码等待，0 表示不限制
+    "watch": False,  # 是否持续监视总文件夹，录制完成的新子文件夹立即处理（Ctrl+C 退出）
+    "watch_interval": 5,  # 监视模式扫描总文件夹的间隔（秒）
+    "watch_stable": 2,  # 监视模式下图片数连续几次扫描不变视为录制完成
+    "watch_marker": "",  # 录制完成标记文件名（如 done），设置后以子文件夹内出现该文件为准
+}
+
+
+def _template_paths(value):
+    """规范化 YAML 中的 template：单个路径或路径列表（多模板 cattail）"""
+    if isinstance(value, list):
+        return [os.path.normpath(path) for path in value]
+    return os.path.normpath(value)
+
+
+def gate_from_yaml(
+    yaml_path,
+    max_threads=None,
+    path=None,
+    debug=False,
+    executor=None,
+    force=False,
+    trace=None,
+    serve=False,
+    watch=False,
+    workers=None,
+):
     """
     从YAML文件读取配置并处理文件夹
 
@@ -423,6 +2412,15 @@ def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
         max_threads: 最大线程数，如果为None则从YAML配置中读取或使用默认值
         path: 总文件夹路径，如果指定则覆盖YAML配置中的path
         debug: Debug模式开关，默认为False
+        executor: 并行方式（"thread"/"process"），如果指定则覆盖YAML配置中的executor
+        force: 是否忽略结果缓存，重新处理所有子文件夹，默认为False
+        trace: 逐帧追踪输出文件路径，如果指定则覆盖YAML配置中的trace
+        serve: 是否由常驻服务调用（JobServer）；追踪与实时指标为进程全局状态，
+              多个任务同时运行时互相干扰，服务模式下忽略 trace 与 metrics_* 选项
+        watch: 是否持续监视总文件夹（见 SubfolderWatcher），默认为False；
+              服务模式下任务须能结束，忽略监视
+        workers: 处理子文件夹的线程池，默认为None表示每次调用新建；
+              服务模式下由 JobServer 提供，所有任务共享
 
     返回:
         处理结果列表
@@ -445,6 +2443,7 @@ def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
     tasks = []
     task_headers = []
     task_type_counts = {}
+    options = dict(GLOBAL_OPTIONS)
 
     for item in config:
         if not isinstance(item, dict):
@@ -460,6 +2459,13 @@ def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
             max_threads = item["max_threads"]
             continue
 
+        # 提取全局选项
+        if any(key in GLOBAL_OPTIONS for key in item):
+            for key, value in item.items():
+                if key in GLOBAL_OPTIONS:
+                    options[key] = value
+            continue
+
         # 提取任务信息
         for task_type, task_config in item.items():
             if task_type in ("path", "max_threads"):
@@ -481,14 +2487,14 @@ def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
                     for param in task_config:
                         for key, value in param.items():
                             if key == "template":
-                                task_kwargs["template_path"] = os.path.normpath(value)
+                                task_kwargs["template_path"] = _template_paths(value)
                             else:
                                 task_kwargs[key] = value
                 elif isinstance(task_config, dict):
                     # 新版格式: task_config 是一个字典
                     for key, value in task_config.items():
                         if key == "template":
-                            task_kwargs["template_path"] = os.path.normpath(value)
+                            task_kwargs["template_path"] = _template_paths(value)
                         else:
                             task_kwargs[key] = value
                 elif task_config is None:
@@ -537,308 +2543,1549 @@ def gate_from_yaml(yaml_path, max_threads=None, path=None, debug=False):
                         )
                         task_kwargs["limit"] = 0
 
-            tasks.append(task_kwargs)
+                # 验证 decode_scale 参数
+                if "decode_scale" in task_kwargs:
+                    scale_value = task_kwargs["decode_scale"]
+                    if scale_value not in (1, 2, 4, 8):
+                        print(
+                            f"🟠 【警告】{task_type} 的 decode_scale 参数 '{scale_value}' 无效，须为 1、2、4 或 8。降分辨率解码倍数，已用默认值 1（原始分辨率）"
+                        )
+                        task_kwargs["decode_scale"] = 1
+
+                # 验证 pyramid_levels 参数
+                if "pyramid_levels" in task_kwargs:
+                    levels_value = task_kwargs["pyramid_levels"]
+                    if levels_value not in (0, 1, 2, 3):
+                        print(
+                            f"🟠 【警告】{task_type} 的 pyramid_levels 参数 '{levels_value}' 无效，须为 0~3。金字塔匹配层数，已用默认值 0（全图匹配）"
+                        )
+                        task_kwargs["pyramid_levels"] = 0
+
+                # 验证 batch 参数
+                if "batch" in task_kwargs:
+                    batch_value = task_kwargs["batch"]
+                    if (
+                        not isinstance(batch_value, int)
+                        or isinstance(batch_value, bool)
+                        or batch_value < 0
+                    ):
+                        print(
+                            f"🟠 【警告】{task_type} 的 batch 参数 '{batch_value}' 无效，须为非负整数。逐帧批量检测帧数，已用默认值 0（不批量）"
+                        )
+                        task_kwargs["batch"] = 0
+
+                # 验证 search 参数
+                if "search" in task_kwargs:
+                    search_value = task_kwargs["search"]
+                    if search_value not in ("leap", "bisect"):
+                        print(
+                            f"🟠 【警告】{task_type} 的 search 参数 '{search_value}' 无效，须为 leap 或 bisect。搜索策略，已用默认值 leap（智能跳帧）"
+                        )
+                        task_kwargs["search"] = "leap"
+
+            tasks.append(task_kwargs)
+
+    # 命令行参数path优先级最高，覆盖YAML配置
+    if path is not None:
+        parent_folder = os.path.normpath(path)
+
+    # 验证总文件夹路径
+    if not parent_folder:
+        raise ValueError("⛔ 【错误】未指定总文件夹 path 路径（YAML配置或命令行参数）")
+    if not os.path.isdir(parent_folder):
+        raise NotADirectoryError(f"⛔ 【错误】总文件夹 path 路径无效: {parent_folder}")
+
+    # 验证全局选项
+    frame_cache_mb = options["frame_cache_mb"]
+    if not isinstance(frame_cache_mb, (int, float)) or frame_cache_mb < 0:
+        print(
+            f"🟠 【警告】frame_cache_mb 参数 '{frame_cache_mb}' 无效，须为非负数。帧缓存内存上限，已用默认值 {GLOBAL_OPTIONS['frame_cache_mb']}"
+        )
+        options["frame_cache_mb"] = GLOBAL_OPTIONS["frame_cache_mb"]
+
+    if not isinstance(options["prior"], bool):
+        print(
+            f"🟠 【警告】prior 参数 '{options['prior']}' 无效，须为布尔值。先验引导搜索，已用默认值 False（从头搜索）"
+        )
+        options["prior"] = False
+
+    prefetch = options["prefetch"]
+    if not isinstance(prefetch, int) or isinstance(prefetch, bool) or prefetch < 0:
+        print(
+            f"🟠 【警告】prefetch 参数 '{prefetch}' 无效，须为非负整数。后台预取帧数，已用默认值 0（不预取）"
+        )
+        options["prefetch"] = 0
+
+    max_memory_mb = options["max_memory_mb"]
+    if (
+        not isinstance(max_memory_mb, (int, float))
+        or isinstance(max_memory_mb, bool)
+        or max_memory_mb < 0
+    ):
+        print(
+            f"🟠 【警告】max_memory_mb 参数 '{max_memory_mb}' 无效，须为非负数。解码帧内存上限，已用默认值 0（不限制）"
+        )
+        options["max_memory_mb"] = 0
+
+    speculate = options["speculate"]
+    if not isinstance(speculate, int) or isinstance(speculate, bool) or speculate < 0:
+        print(
+            f"🟠 【警告】speculate 参数 '{speculate}' 无效，须为非负整数。推测窗口宽度，已用默认值 0（逐个检测）"
+        )
+        options["speculate"] = 0
+
+    for key in ("result_cache", "force", "watch"):
+        if not isinstance(options[key], bool):
+            print(
+                f"🟠 【警告】{key} 参数 '{options[key]}' 无效，须为布尔值，已用默认值 {GLOBAL_OPTIONS[key]}"
+            )
+            options[key] = GLOBAL_OPTIONS[key]
+    if force:
+        options["force"] = True
+    if watch:
+        options["watch"] = True
+
+    watch_interval = options["watch_interval"]
+    if (
+        not isinstance(watch_interval, (int, float))
+        or isinstance(watch_interval, bool)
+        or watch_interval <= 0
+    ):
+        print(
+            f"🟠 【警告】watch_interval 参数 '{watch_interval}' 无效，须为正数。监视扫描间隔，已用默认值 5"
+        )
+        options["watch_interval"] = 5
+    watch_stable = options["watch_stable"]
+    if (
+        not isinstance(watch_stable, int)
+        or isinstance(watch_stable, bool)
+        or watch_stable < 1
+    ):
+        print(
+            f"🟠 【警告】watch_stable 参数 '{watch_stable}' 无效，须为正整数。图片数不变的扫描次数，已用默认值 2"
+        )
+        options["watch_stable"] = 2
+    if not isinstance(options["watch_marker"], str):
+        print(
+            f"🟠 【警告】watch_marker 参数 '{options['watch_marker']}' 无效，须为文件名，已改为按图片数判断录制完成"
+        )
+        options["watch_marker"] = ""
+
+    if options["thumbnail_index"] not in (0, 2, 4, 8):
+        print(
+            f"🟠 【警告】thumbnail_index 参数 '{options['thumbnail_index']}' 无效，须为 0、2、4 或 8，已禁用缩略图索引"
+        )
+        options["thumbnail_index"] = 0
+
+    # 服务模式下不支持逐帧追踪、实时指标与监视，内存上限由服务启动参数统一设置
+    if serve:
+        ignored = [
+            key
+            for key in (
+                "trace",
+                "metrics_port",
+                "metrics_file",
+                "watch",
+                "max_memory_mb",
+            )
+            if options[key]
+        ]
+        if ignored:
+            print(f"🟠 【警告】服务模式下忽略 {', '.join(ignored)} 参数")
+        options.update(
+            trace="", metrics_port=0, metrics_file="", watch=False, max_memory_mb=0
+        )
+
+    # 命令行参数trace优先级高于YAML配置
+    if trace is not None and not serve:
+        options["trace"] = trace
+    if not isinstance(options["trace"], str):
+        print(
+            f"🟠 【警告】trace 参数 '{options['trace']}' 无效，须为文件路径，已禁用逐帧追踪"
+        )
+        options["trace"] = ""
+
+    metrics_port = options["metrics_port"]
+    if (
+        not isinstance(metrics_port, int)
+        or isinstance(metrics_port, bool)
+        or not 0 <= metrics_port <= 65535
+    ):
+        print(
+            f"🟠 【警告】metrics_port 参数 '{metrics_port}' 无效，须为 0~65535 的整数，已禁用 HTTP 指标"
+        )
+        options["metrics_port"] = 0
+    if not isinstance(options["metrics_file"], str):
+        print(
+            f"🟠 【警告】metrics_file 参数 '{options['metrics_file']}' 无效，须为文件路径，已禁用指标文件"
+        )
+        options["metrics_file"] = ""
+    metrics_interval = options["metrics_interval"]
+    if (
+        not isinstance(metrics_interval, (int, float))
+        or isinstance(metrics_interval, bool)
+        or metrics_interval <= 0
+    ):
+        print(
+            f"🟠 【警告】metrics_interval 参数 '{metrics_interval}' 无效，须为正数，已用默认值 5"
+        )
+        options["metrics_interval"] = 5
+
+    if isinstance(options["sinks"], str):
+        options["sinks"] = [options["sinks"]]
+    if not isinstance(options["sinks"], list) or not options["sinks"]:
+        print(
+            f"🟠 【警告】sinks 参数 '{options['sinks']}' 无效，须为 csv、detail、jsonl、sqlite 的列表，已用默认值 [csv]"
+        )
+        options["sinks"] = ["csv"]
+    invalid_sinks = [name for name in options["sinks"] if name not in RESULT_SINKS]
+    if invalid_sinks:
+        print(
+            f"🟠 【警告】sinks 参数中的 {invalid_sinks} 无效，须为 csv、detail、jsonl 或 sqlite，已忽略"
+        )
+    options["sinks"] = [
+        name for name in dict.fromkeys(options["sinks"]) if name in RESULT_SINKS
+    ] or ["csv"]
+    flush_interval = options["sink_flush_interval"]
+    if (
+        not isinstance(flush_interval, (int, float))
+        or isinstance(flush_interval, bool)
+        or flush_interval <= 0
+    ):
+        print(
+            f"🟠 【警告】sink_flush_interval 参数 '{flush_interval}' 无效，须为正数，已用默认值 1"
+        )
+        options["sink_flush_interval"] = 1
+
+    if options["schedule"] not in ("size", "scan"):
+        print(
+            f"🟠 【警告】schedule 参数 '{options['schedule']}' 无效，须为 size 或 scan。子文件夹提交顺序，已用默认值 size（帧数多的优先）"
+        )
+        options["schedule"] = "size"
+
+    if options["video_label"] not in ("index", "time"):
+        print(
+            f"🟠 【警告】video_label 参数 '{options['video_label']}' 无效，须为 index 或 time。视频帧标签，已用默认值 index（帧序号）"
+        )
+        options["video_label"] = "index"
+
+    # 命令行参数executor优先级高于YAML配置
+    if executor is not None:
+        options["executor"] = executor
+    if options["executor"] not in ("thread", "process"):
+        print(
+            f"🟠 【警告】executor 参数 '{options['executor']}' 无效，须为 thread 或 process。并行方式，已用默认值 thread（线程池）"
+        )
+        options["executor"] = "thread"
+    if serve and options["executor"] == "process":
+        print("🟠 【警告】服务模式只支持线程池，已忽略 executor: process")
+        options["executor"] = "thread"
+
+    # 验证模板图片路径（只有 cattail 支持多模板，其他任务使用第一个模板）
+    for idx, task_kwargs in enumerate(tasks):
+        template_path = task_kwargs.get("template_path")
+        if isinstance(template_path, list):
+            if not template_path:
+                task_kwargs.pop("template_path")
+                template_path = None
+            elif task_kwargs["task_type"] != "cattail":
+                print(
+                    f"🟠 【警告】任务 {idx + 1} ({task_kwargs['task_type']}) 不支持多个模板，只使用第一个模板: {template_path[0]}"
+                )
+                template_path = task_kwargs["template_path"] = template_path[0]
+            elif len(template_path) == 1:
+                template_path = task_kwargs["template_path"] = template_path[0]
+        paths = template_path if isinstance(template_path, list) else [template_path]
+        for path in paths:
+            if path and not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"⛔ 【错误】任务 {idx + 1} 的模板图片不存在: {path}"
+                )
+
+    if not tasks:
+        tasks = [{}]
+        task_headers = ["default1"]
+
+    # 编译任务：每个模板只在此处解码、预处理一次，供所有子文件夹复用
+    for task_kwargs in tasks:
+        if task_kwargs.get("task_type") != "skip":
+            task_kwargs["detector"] = compile_task(task_kwargs)
+
+    # 如果未指定最大线程数，使用默认值
+    if max_threads is None:
+        max_threads = os.cpu_count() or 8  # 默认使用CPU核心数
+
+    # 执行任务处理
+    return gate_multi_thread(
+        parent_folder, tasks, task_headers, max_threads, debug, options, serve, workers
+    )
+
+
+def process_subfolder(
+    subfolder,
+    tasks,
+    csv_filename,
+    csv_queue,
+    debug=False,
+    options=None,
+    prior=None,
+):
+    """
+    处理单个子文件夹的所有任务，在单独线程中执行
+
+    参数:
+        subfolder: 子文件夹路径，也可以是视频文件路径（见 VIDEO_EXTENSIONS）
+        tasks: 任务参数列表
+        csv_filename: CSV结果文件路径
+        csv_queue: 用于异步写入的结果队列（见 result_writer_worker）
+        debug: Debug模式开关
+        options: 全局选项字典（见 GLOBAL_OPTIONS），默认为None使用默认值
+        prior: 匹配位置先验（OffsetPrior），默认为None表示从头搜索
+
+    返回:
+        (subfolder_name, subfolder_results, total_time): 处理结果和耗时
+    """
+    subfolder_name = os.path.basename(subfolder)
+    subfolder_results = []
+    csv_row = [subfolder_name]
+    total_time = 0
+
+    options = {**GLOBAL_OPTIONS, **(options or {})}
+    tracer.set_context(subfolder=subfolder_name, task=None)
+
+    # 视频文件：以帧标签代替图片文件名，按需解码
+    video_source = None
+    if os.path.isfile(subfolder) and subfolder.lower().endswith(VIDEO_EXTENSIONS):
+        video_source = VideoFrameSource(subfolder, options["video_label"])
+        image_files = list(video_source.labels)
+    else:
+        # 获取并自然排序图片文件
+        image_files = [
+            f for f in os.listdir(subfolder) if f.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        image_files.sort(
+            key=lambda s: [
+                int(text) if text.isdigit() else text.lower()
+                for text in re.split(r"(/d+)", s)
+            ]
+        )
+
+    # 缩略图索引、预取线程、推测窗口线程与视频句柄在任务出错时同样释放
+    # （监视、服务模式下进程长期运行，泄漏会一直累积）
+    thumbnails = None
+    prefetcher = None
+    speculator = None
+    try:
+        # 初始化剩余图片列表
+        remaining_files = image_files.copy()
+
+        # 缩略图索引：不存在或图片已变化时先建立索引
+        if options["thumbnail_index"] and video_source is None:
+            thumbnails = ThumbnailIndex(
+                subfolder, image_files, options["thumbnail_index"]
+            )
+            if debug and thumbnails.rebuilt:
+                print(
+                    f"ℹ️ 【调试：索引】子文件夹 {subfolder_name}: 已建立缩略图索引（{len(image_files)} 帧，1/{thumbnails.scale} 分辨率）"
+                )
+
+        # 子文件夹帧缓存，所有任务共享，子文件夹处理完即释放（视频始终经由缓存解码）
+        frame_cache = None
+        if video_source is not None:
+            frame_cache = FrameCache(options["frame_cache_mb"], video_source.decode)
+        elif options["frame_cache_mb"] > 0 or thumbnails is not None:
+            frame_cache = FrameCache(options["frame_cache_mb"], thumbnails=thumbnails)
+
+        # 帧预取器，所有任务共享
+        if options["prefetch"] > 0:
+            if frame_cache is None:
+                frame_cache = FrameCache(0)  # 只解码不缓存
+            prefetcher = FramePrefetcher(frame_cache, options["prefetch"])
+
+        # 推测检测窗口，所有任务共享（视频按顺序解码，不推测）
+        if options["speculate"] > 1 and video_source is None:
+            speculator = SpeculativeWindow(options["speculate"])
+
+        # 执行每个任务
+        for task_idx, task_kwargs in enumerate(tasks):
+            if not remaining_files:
+                print(
+                    f"🟠 【警告】子文件夹 {subfolder_name}: 没有剩余图片，跳过剩余任务"
+                )
+                csv_row.append("未执行")
+                continue
+
+            # 检查是否为跳过操作
+            if task_kwargs.get("task_type") == "skip":
+                skip_count = task_kwargs.get("skip_count", 0)
+                if skip_count > len(remaining_files):
+                    skip_count = len(remaining_files)
+
+                remaining_files = remaining_files[skip_count:]
+
+                print(
+                    f"【跳过】子文件夹 {subfolder_name}: 跳过前 {skip_count} 张图片，剩余 {len(remaining_files)} 张图片"
+                )
+                csv_row.append(f"跳过{skip_count}张")
+
+                subfolder_results.append(
+                    {
+                        "task_idx": task_idx + 1,
+                        "matched_file": None,
+                        "status": f"SKIP_{skip_count}",
+                        "time": 0,
+                    }
+                )
+                continue
+
+            # 准备任务参数
+            task_kwargs_copy = task_kwargs.copy()
+            task_type = task_kwargs_copy.pop("task_type", None)  # 获取任务类型
+            template_path = task_kwargs_copy.pop("template_path", None)
+
+            # 提取limit参数（如果存在）
+            limit_param = task_kwargs_copy.pop("limit", 0)
+
+            # 使用编译好的检测器（gate_from_yaml 中生成），未编译时现场编译
+            detector_func = task_kwargs_copy.pop("detector", None)
+            if detector_func is None:
+                detector_func = compile_task(task_kwargs)
+            for key in DETECTOR_PARAMS:  # 已绑定到检测器
+                task_kwargs_copy.pop(key, None)
+
+            # 执行任务并计时
+            start_time = time.time()
+
+            # Debug模式：输出任务配置信息
+            if debug:
+                threshold_value = task_kwargs_copy.get("threshold", "默认值")
+                fade_value = task_kwargs_copy.get("fade", False)
+                crop_value = task_kwargs_copy.get("crop", 0)
+                search_value = task_kwargs_copy.get("search", "leap")
+                print(
+                    f"ℹ️ 【调试：任务配置】检测方法: {task_type} | 目标阈值: {threshold_value} | 消失: {fade_value} | 裁剪: {crop_value} | 搜索: {search_value}"
+                )
+
+            trails_stats = {"evaluated": 0}
+            tracer.set_context(task=f"{task_type}{task_idx + 1}")
+            hint = prior.expected(task_idx) if prior is not None else None
+            if debug and hint is not None:
+                print(f"ℹ️ 【调试：先验搜索】从期望位置 {hint} 开始搜索")
+
+            with tracer.span("task", index=task_idx + 1, type=task_type):
+                status, matched_file, result = trails(
+                    image_files=remaining_files,
+                    folder_path=subfolder,
+                    template_path=template_path,
+                    detector_func=detector_func,  # 传递检测函数
+                    limit=limit_param,  # 传递limit参数
+                    debug=debug,  # 传递debug参数
+                    frame_cache=frame_cache,  # 传递帧缓存
+                    stats=trails_stats,  # 收集检测帧数
+                    hint=hint,  # 传递期望匹配位置
+                    prefetcher=prefetcher,  # 传递帧预取器
+                    speculator=speculator,  # 推测检测窗口
+                    **task_kwargs_copy,
+                )
+            time_taken = time.time() - start_time
+            total_time += time_taken
+
+            # 记录结果
+            subfolder_results.append(
+                {
+                    "task_idx": task_idx + 1,
+                    "matched_file": matched_file,
+                    "status": status,
+                    "time": time_taken,
+                    "evaluated": trails_stats["evaluated"],
+                    "confidence": result[2] if result else None,
+                }
+            )
+            template_note = ""
+            if result and len(result) > 4:  # 多模板 cattail：置信度最高的模板
+                subfolder_results[-1]["template"] = os.path.basename(result[4])
+                template_note = f", 模板 {subfolder_results[-1]['template']}"
+
+            print(
+                f"【进展】子文件夹 {subfolder_name}: 任务 {task_idx + 1} ({task_type}), "
+                f"匹配 {matched_file}, 状态 {status}, 检测 {trails_stats['evaluated']} 帧, 耗时 {time_taken:.2f}秒{template_note}"
+            )
+
+            # 更新CSV行
+            csv_row.append(matched_file if status == "PASS" else status)
+
+            # 处理任务失败或继续执行
+            if status != "PASS":
+                print(
+                    f"🟠 【警告】子文件夹 {subfolder_name}: 任务 {task_idx + 1} 返回非PASS状态，跳过剩余任务"
+                )
+                csv_row.extend(["未执行"] * (len(tasks) - task_idx - 1))
+                break
+
+            # 更新剩余图片列表
+            if matched_file in remaining_files:
+                match_index = remaining_files.index(matched_file)
+                if prior is not None:
+                    prior.record(task_idx, match_index)
+                remaining_files = remaining_files[match_index + 1 :]
+                print(
+                    f"【继续】子文件夹 {subfolder_name}: 继续已处理图片，剩余 {len(remaining_files)} 张图片"
+                )
+    finally:
+        if speculator is not None:
+            speculator.close()
+        if prefetcher is not None:
+            prefetcher.close()
+        if video_source is not None:
+            video_source.release()
+        if thumbnails is not None:
+            thumbnails.close()
+
+    if debug and speculator is not None:
+        print(
+            f"ℹ️ 【调试：推测检测】子文件夹 {subfolder_name}: 窗口宽度 {options['speculate']}，并行检测 {speculator.submitted} 帧"
+        )
+
+    if debug and prefetcher is not None:
+        prefetch_stats = prefetcher.stats()
+        reads = prefetch_stats["hits"] + prefetch_stats["misses"]
+        hit_rate = prefetch_stats["hits"] / reads * 100 if reads else 0
+        print(
+            f"ℹ️ 【调试：帧预取】子文件夹 {subfolder_name}: 命中率 {hit_rate:.1f}% | 命中 {prefetch_stats['hits']} | 未命中 {prefetch_stats['misses']} | 提交 {prefetch_stats['issued']} | 失效取消 {prefetch_stats['dropped']}"
+        )
+
+    if debug and thumbnails is not None:
+        print(
+            f"ℹ️ 【调试：索引】子文件夹 {subfolder_name}: 从缩略图索引读取 {thumbnails.hits} 帧"
+        )
+
+    if debug and frame_cache is not None:
+        cache_stats = frame_cache.stats()
+        print(
+            f"ℹ️ 【调试：帧缓存】子文件夹 {subfolder_name}: 解码 {cache_stats['misses']} 帧，帧缓存节省解码 {cache_stats['hits']} 次"
+        )
+
+    # 异步写入结果
+    csv_queue.put(
+        {"subfolder": subfolder_name, "row": csv_row, "results": subfolder_results}
+    )
+    # print(f"【写入】子文件夹 {subfolder_name} 的结果已加入写入队列")
+
+    return subfolder_name, subfolder_results, total_time
+
+
+# 进程池模式下，子进程初始化时接收的已编译任务（每个子进程只传输、加载一次）
+_worker_tasks = None
+
+
+def _init_process_worker(tasks, metrics_sink=None, memory_mb=0):
+    """
+    进程池子进程初始化：保存已编译任务，模板随任务一并预加载
+
+    参数:
+        tasks: 任务参数列表（含 PreparedDetector）
+        metrics_sink: 实时指标增量队列，提供时启用指标并定期送回主进程
+        memory_mb: 本进程的解码帧内存上限（MB），0 表示不限制
+    """
+    global _worker_tasks
+    _worker_tasks = tasks
+    # Ctrl+C 由主进程处理（监视模式下等待处理中的子文件夹完成），子进程不随之中断
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    memory_budget.configure(memory_mb)
+    if metrics_sink is not None:
+        metrics.enabled = True
+        metrics.sink = metrics_sink
+
+
+def _process_subfolder_worker(
+    subfolder, csv_filename, csv_queue, debug=False, options=None, prior=None
+):
+    """
+    进程池入口：使用子进程初始化时加载的任务处理单个子文件夹
+
+    返回:
+        process_subfolder 的返回值加上本子文件夹的追踪事件（未追踪时为空列表）
+        和 (进程号, 本进程内存预算统计)
+    """
+    tracer.enabled = bool(options and options.get("trace"))
+    outcome = process_subfolder(
+        subfolder, _worker_tasks, csv_filename, csv_queue, debug, options, prior
+    )
+    if metrics.enabled:
+        metrics.flush()
+    return (*outcome, tracer.drain(), (os.getpid(), memory_budget.stats()))
+
+
+# ========== 结果缓存：未变化的子文件夹不再处理，中断后可续跑 ==========
+
+
+def _subfolder_fingerprint(subfolder):
+    """
+    计算子文件夹指纹（图片文件名、大小、修改时间），视频文件取自身大小与修改时间
+
+    返回:
+        十六进制摘要字符串
+    """
+    digest = hashlib.sha1()
+    if os.path.isfile(subfolder):
+        stat = os.stat(subfolder)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    entries = sorted(
+        (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(subfolder)
+        if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    for name, size, mtime in entries:
+        digest.update(f"{name}:{size}:{mtime}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+# 影响匹配结果的全局选项，计入结果缓存的配置摘要
+RESULT_OPTIONS = ("video_label", "prior", "thumbnail_index")
+
+
+def _effective_params(task_kwargs):
+    """
+    返回任务实际生效的参数：trails 与检测函数的默认值，被任务配置覆盖
+
+    未写在 YAML 中的参数（如 search、leap、threshold）也计入配置摘要，
+    修改默认值后不会沿用旧结果
+    """
+    params = {}
+    funcs = [trails, DETECTORS.get(task_kwargs.get("task_type"))]
+    for func in filter(None, funcs):
+        for name, param in inspect.signature(func).parameters.items():
+            if isinstance(param.default, (bool, int, float, str)):
+                params[name] = param.default
+    params.update(
+        (key, value) for key, value in task_kwargs.items() if key != "detector"
+    )
+    return params
+
+
+def _config_hash(tasks, options):
+    """
+    计算任务配置摘要（实际生效的任务参数、模板文件大小与修改时间、
+    影响结果的全局选项 RESULT_OPTIONS）
+
+    返回:
+        十六进制摘要字符串
+    """
+    config = []
+    for task_kwargs in tasks:
+        task = _effective_params(task_kwargs)
+        template_path = task.get("template_path")
+        if isinstance(template_path, list):
+            task["template_stat"] = [
+                [os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                for path in template_path
+                if os.path.exists(path)
+            ]
+        elif template_path and os.path.exists(template_path):
+            stat = os.stat(template_path)
+            task["template_stat"] = [stat.st_size, stat.st_mtime_ns]
+        config.append(task)
+    payload = {"tasks": config}
+    payload.update((key, options.get(key)) for key in RESULT_OPTIONS)
+    return hashlib.sha1(
+        json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _csv_row_from_results(subfolder_name, subfolder_results, task_count):
+    """
+    由子文件夹结果还原 CSV 行（与 process_subfolder 写入的格式一致）
+
+    返回:
+        CSV 行列表
+    """
+    csv_row = [subfolder_name]
+    for result in subfolder_results:
+        status = result["status"]
+        if status.startswith("SKIP_"):
+            csv_row.append(f"跳过{status[5:]}张")
+        else:
+            csv_row.append(result["matched_file"] if status == "PASS" else status)
+    csv_row.extend(["未执行"] * (task_count - len(subfolder_results)))
+    return csv_row
+
+
+class ResultCache:
+    """
+    持久化结果缓存（SQLite），保存在总文件夹中，与 CSV 结果文件相邻
+
+    以子文件夹名为主键，记录子文件夹指纹与任务配置摘要；两者均未变化时直接复用结果。
+    每个子文件夹完成后立即提交，程序中断后重新运行即从未完成的子文件夹继续。
+    只在主线程中使用。
 
-    # 命令行参数path优先级最高，覆盖YAML配置
-    if path is not None:
-        parent_folder = os.path.normpath(path)
+    参数:
+        db_path: SQLite 文件路径
+    """
 
-    # 验证总文件夹路径
-    if not parent_folder:
-        raise ValueError("⛔ 【错误】未指定总文件夹 path 路径（YAML配置或命令行参数）")
-    if not os.path.isdir(parent_folder):
-        raise NotADirectoryError(f"⛔ 【错误】总文件夹 path 路径无效: {parent_folder}")
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "subfolder TEXT PRIMARY KEY, fingerprint TEXT, config_hash TEXT, "
+            "results TEXT, updated REAL)"
+        )
+        self.conn.commit()
+
+    def lookup(self, subfolder_name, fingerprint, config_hash):
+        """查找缓存结果，指纹或配置不一致时返回None"""
+        row = self.conn.execute(
+            "SELECT results FROM results WHERE subfolder = ? AND fingerprint = ? AND config_hash = ?",
+            (subfolder_name, fingerprint, config_hash),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store(self, subfolder_name, fingerprint, config_hash, subfolder_results):
+        """保存子文件夹结果并立即提交"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (
+                subfolder_name,
+                fingerprint,
+                config_hash,
+                json.dumps(subfolder_results, ensure_ascii=False),
+                time.time(),
+            ),
+        )
+        self.conn.commit()
 
-    # 验证模板图片路径
-    for idx, task_kwargs in enumerate(tasks):
-        template_path = task_kwargs.get("template_path")
-        if template_path and not os.path.exists(template_path):
-            raise FileNotFoundError(
-                f"⛔ 【错误】任务 {idx + 1} 的模板图片不存在: {template_path}"
-            )
+    def clear(self):
+        """清空缓存"""
+        self.conn.execute("DELETE FROM results")
+        self.conn.commit()
 
-    if not tasks:
-        tasks = [{}]
-        task_headers = ["default1"]
+    def close(self):
+        self.conn.close()
 
-    # 如果未指定最大线程数，使用默认值
-    if max_threads is None:
-        max_threads = os.cpu_count() or 8  # 默认使用CPU核心数
 
-    # 执行任务处理
-    return gate_multi_thread(parent_folder, tasks, task_headers, max_threads, debug)
+# ========== 结果输出：CSV / JSONL / SQLite，保持文件打开，批量写入、定期刷新 ==========
+RESULT_SINKS = ("csv", "detail", "jsonl", "sqlite")
 
 
-def process_subfolder(subfolder, tasks, csv_filename, csv_queue, debug=False):
+def _open_with_retry(opener, path, max_retries=3, retry_delay=0.1):
     """
-    处理单个子文件夹的所有任务，在单独线程中执行
+    打开结果文件，遇到权限错误（如文件被 Excel 占用）时重试
+
+    返回:
+        opener() 的返回值，重试仍失败时抛出 PermissionError
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return opener()
+        except PermissionError as e:
+            if attempt < max_retries:
+                print(f"【写入】打开结果文件权限错误（重试 {attempt+1}/{max_retries}）")
+                time.sleep(retry_delay * (attempt + 1))
+            else:
+                raise PermissionError(
+                    f"⛔ 【错误】无法打开结果文件 {path}: {str(e)}"
+                ) from e
+
+
+def _task_details(record, task_headers):
+    """展开子文件夹记录中的各任务详细结果"""
+    return [
+        {
+            "task": task_headers[result["task_idx"] - 1],
+            "status": result["status"],
+            "matched_file": result.get("matched_file"),
+            "confidence": result.get("confidence"),
+            "time": round(result.get("time", 0), 4),
+            "evaluated": result.get("evaluated", 0),
+            "template": result.get("template"),
+        }
+        for result in record["results"]
+    ]
+
+
+def _drop_replaced(lines, key, replaced):
+    """
+    去掉重新处理的子文件夹的旧结果：每个子文件夹只保留最后写入的 replaced[名称] 行
 
     参数:
-        subfolder: 子文件夹路径
-        tasks: 任务参数列表
-        csv_filename: CSV结果文件路径
-        csv_queue: 用于异步写入的队列
-        debug: Debug模式开关
+        lines: 行列表（按写入顺序）
+        key: 取得行所属子文件夹名的函数，不属于任何子文件夹时返回None
+        replaced: {子文件夹名: 最近一次写入的行数}
 
     返回:
-        (subfolder_name, subfolder_results, total_time): 处理结果和耗时
+        去重后的行列表，顺序不变
     """
-    subfolder_name = os.path.basename(subfolder)
-    subfolder_results = []
-    csv_row = [subfolder_name]
-    total_time = 0
+    remaining = dict(replaced)
+    kept = []
+    for line in reversed(lines):
+        name = key(line)
+        if name in remaining:
+            if remaining[name] <= 0:
+                continue
+            remaining[name] -= 1
+        kept.append(line)
+    kept.reverse()
+    return kept
 
-    # 获取并自然排序图片文件
-    image_files = [
-        f
-        for f in os.listdir(subfolder)
-        if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".gif"))
-    ]
-    image_files.sort(
-        key=lambda s: [
-            int(text) if text.isdigit() else text.lower()
-            for text in re.split(r"(/d+)", s)
-        ]
-    )
 
-    # 初始化剩余图片列表
-    remaining_files = image_files.copy()
+def _rewrite_csv(path, replaced):
+    """按 _drop_replaced 重写 CSV（先写临时文件再替换）"""
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))
+    rows = _drop_replaced(rows, lambda row: row[0] if row else None, replaced)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+        csv.writer(f).writerows(rows)
+    os.replace(tmp_path, path)
 
-    # 执行每个任务
-    for task_idx, task_kwargs in enumerate(tasks):
-        if not remaining_files:
-            print(f"🟠 【警告】子文件夹 {subfolder_name}: 没有剩余图片，跳过剩余任务")
-            csv_row.append("未执行")
-            continue
 
-        # 检查是否为跳过操作
-        if task_kwargs.get("task_type") == "skip":
-            skip_count = task_kwargs.get("skip_count", 0)
-            if skip_count > len(remaining_files):
-                skip_count = len(remaining_files)
+class CsvSink:
+    """
+    CSV 输出：处理结果.csv，每个子文件夹一行，格式与以往相同；
+    重新处理已有结果的子文件夹时追加新行，关闭时去掉旧行
 
-            remaining_files = remaining_files[skip_count:]
+    参数:
+        parent_folder: 总文件夹路径
+        task_headers: 任务表头列表
+    """
 
-            print(
-                f"【跳过】子文件夹 {subfolder_name}: 跳过前 {skip_count} 张图片，剩余 {len(remaining_files)} 张图片"
-            )
-            csv_row.append(f"跳过{skip_count}张")
+    def __init__(self, parent_folder, task_headers):
+        self.task_headers = task_headers
+        self.path = os.path.normpath(os.path.join(parent_folder, "处理结果.csv"))
+        self.written = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", newline="", encoding="utf-8-sig") as f:
+                self.written = {row[0] for row in csv.reader(f) if row}
+        self.replaced = {}  # 重新处理的子文件夹 -> 本次写入的行数
+        self.file, self.writer = self._open(self.path, ["子文件夹名"] + task_headers)
+
+    @staticmethod
+    def _open(path, header):
+        """以追加方式打开 CSV，新文件先写入表头"""
+        is_new = not os.path.exists(path)
+        f = _open_with_retry(
+            lambda: open(path, "a", newline="", encoding="utf-8-sig"), path
+        )
+        writer = csv.writer(f)
+        if is_new:
+            writer.writerow(header)
+        return f, writer
 
-            subfolder_results.append(
-                {
-                    "task_idx": task_idx + 1,
-                    "matched_file": None,
-                    "status": f"SKIP_{skip_count}",
-                    "time": 0,
-                }
-            )
-            continue
+    def write(self, record):
+        if record["subfolder"] in self.written:
+            self.replaced[record["subfolder"]] = 1
+        self.writer.writerow(record["row"])
 
-        # 准备任务参数
-        task_kwargs_copy = task_kwargs.copy()
-        task_type = task_kwargs_copy.pop("task_type", None)  # 获取任务类型
-        template_path = task_kwargs_copy.pop("template_path", None)
-
-        # 提取limit参数（如果存在）
-        limit_param = task_kwargs_copy.pop("limit", 0)
-
-        # 根据任务类型确定检测函数
-        detector_func = None
-        if task_type == "cattail":
-            detector_func = cattail
-        elif task_type == "blover":
-            detector_func = blover
-        elif task_type == "cactus":
-            detector_func = cactus
-        # 可以在这里添加更多检测器函数的映射
-        else:
-            print(f"🟠 【警告】未知的任务类型 {task_type}，默认使用 cattail")
-            detector_func = cattail
+    def flush(self):
+        self.file.flush()
 
-        # 执行任务并计时
-        start_time = time.time()
+    def close(self):
+        self.file.close()
+        if self.replaced:
+            _rewrite_csv(self.path, self.replaced)
 
-        # Debug模式：输出任务配置信息
-        if debug:
-            threshold_value = task_kwargs_copy.get("threshold", "默认值")
-            fade_value = task_kwargs_copy.get("fade", False)
-            crop_value = task_kwargs_copy.get("crop", 0)
-            print(
-                f"ℹ️ 【调试：任务配置】检测方法: {task_type} | 目标阈值: {threshold_value} | 消失: {fade_value} | 裁剪: {crop_value}"
+
+class DetailCsvSink:
+    """
+    CSV 明细输出：处理明细.csv，每个任务一行，含状态、匹配文件、置信度、耗时和检测帧数
+
+    参数:
+        parent_folder: 总文件夹路径
+        task_headers: 任务表头列表
+    """
+
+    HEADER = ["子文件夹名", "任务", "状态", "匹配文件", "置信度", "耗时", "检测帧数"]
+
+    def __init__(self, parent_folder, task_headers):
+        self.task_headers = task_headers
+        self.path = os.path.normpath(os.path.join(parent_folder, "处理明细.csv"))
+        self.written = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", newline="", encoding="utf-8-sig") as f:
+                self.written = {row[0] for row in csv.reader(f) if row}
+        self.replaced = {}  # 重新处理的子文件夹 -> 本次写入的行数
+        self.file, self.writer = CsvSink._open(self.path, self.HEADER)
+
+    def write(self, record):
+        if record["subfolder"] in self.written:
+            self.replaced[record["subfolder"]] = len(record["results"])
+        for detail in _task_details(record, self.task_headers):
+            self.writer.writerow(
+                [
+                    record["subfolder"],
+                    detail["task"],
+                    detail["status"],
+                    detail["matched_file"] or "",
+                    "" if detail["confidence"] is None else detail["confidence"],
+                    detail["time"],
+                    detail["evaluated"],
+                ]
             )
 
-        status, matched_file, _ = trails(
-            image_files=remaining_files,
-            folder_path=subfolder,
-            template_path=template_path,
-            detector_func=detector_func,  # 传递检测函数
-            limit=limit_param,  # 传递limit参数
-            debug=debug,  # 传递debug参数
-            **task_kwargs_copy,
-        )
-        time_taken = time.time() - start_time
-        total_time += time_taken
-
-        # 记录结果
-        subfolder_results.append(
-            {
-                "task_idx": task_idx + 1,
-                "matched_file": matched_file,
-                "status": status,
-                "time": time_taken,
-            }
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.replaced:
+            _rewrite_csv(self.path, self.replaced)
+
+
+class JsonlSink:
+    """
+    JSONL 输出：处理结果.jsonl，每个子文件夹一行，含汇总行与各任务详细结果；
+    重新处理已有结果的子文件夹时追加新行，关闭时去掉旧行
+
+    参数:
+        parent_folder: 总文件夹路径
+        task_headers: 任务表头列表
+    """
+
+    def __init__(self, parent_folder, task_headers):
+        self.task_headers = task_headers
+        self.path = os.path.normpath(os.path.join(parent_folder, "处理结果.jsonl"))
+        self.written = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.written.add(json.loads(line)["subfolder"])
+                    except (ValueError, KeyError):
+                        continue  # 中断时写了一半的行
+        self.replaced = {}  # 重新处理的子文件夹 -> 本次写入的行数
+        self.file = _open_with_retry(
+            lambda: open(self.path, "a", encoding="utf-8"), self.path
         )
 
-        print(
-            f"【进展】子文件夹 {subfolder_name}: 任务 {task_idx + 1} ({task_type}), "
-            f"匹配 {matched_file}, 状态 {status}, 耗时 {time_taken:.2f}秒"
+    def write(self, record):
+        if record["subfolder"] in self.written:
+            self.replaced[record["subfolder"]] = 1
+        line = {
+            "subfolder": record["subfolder"],
+            "row": dict(zip(["子文件夹名"] + self.task_headers, record["row"])),
+            "tasks": _task_details(record, self.task_headers),
+            "written": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _subfolder(line):
+        try:
+            return json.loads(line)["subfolder"]
+        except (ValueError, KeyError):
+            return None
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.replaced:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = _drop_replaced(f.readlines(), self._subfolder, self.replaced)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.path)
+
+
+class SqliteSink:
+    """
+    SQLite 输出：处理结果.sqlite 的 results 表，每个任务一行，
+    以 (子文件夹名, 任务序号) 为主键，重新处理的子文件夹覆盖旧结果
+
+    参数:
+        parent_folder: 总文件夹路径
+        task_headers: 任务表头列表
+    """
+
+    def __init__(self, parent_folder, task_headers):
+        self.task_headers = task_headers
+        self.path = os.path.normpath(os.path.join(parent_folder, "处理结果.sqlite"))
+        # 在主线程中创建与关闭，只由写入线程使用
+        self.conn = _open_with_retry(
+            lambda: sqlite3.connect(self.path, check_same_thread=False), self.path
         )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "subfolder TEXT, task_idx INTEGER, task TEXT, status TEXT, "
+            "matched_file TEXT, confidence REAL, time REAL, evaluated INTEGER, "
+            "updated REAL, PRIMARY KEY (subfolder, task_idx))"
+        )
+        self.conn.commit()
+        self.written = {
+            row[0]
+            for row in self.conn.execute("SELECT DISTINCT subfolder FROM results")
+        }
 
-        # 更新CSV行
-        csv_row.append(matched_file if status == "PASS" else status)
+    def write(self, record):
+        now = time.time()
+        self.conn.execute(
+            "DELETE FROM results WHERE subfolder = ?", (record["subfolder"],)
+        )
+        self.conn.executemany(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    record["subfolder"],
+                    task_idx,
+                    detail["task"],
+                    detail["status"],
+                    detail["matched_file"],
+                    detail["confidence"],
+                    detail["time"],
+                    detail["evaluated"],
+                    now,
+                )
+                for task_idx, detail in enumerate(
+                    _task_details(record, self.task_headers), start=1
+                )
+            ],
+        )
 
-        # 处理任务失败或继续执行
-        if status != "PASS":
-            print(
-                f"🟠 【警告】子文件夹 {subfolder_name}: 任务 {task_idx + 1} 返回非PASS状态，跳过剩余任务"
-            )
-            csv_row.extend(["未执行"] * (len(tasks) - task_idx - 1))
-            break
+    def flush(self):
+        self.conn.commit()
 
-        # 更新剩余图片列表
-        if matched_file in remaining_files:
-            match_index = remaining_files.index(matched_file)
-            remaining_files = remaining_files[match_index + 1 :]
-            print(
-                f"【继续】子文件夹 {subfolder_name}: 继续已处理图片，剩余 {len(remaining_files)} 张图片"
-            )
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
 
-    # 异步写入CSV
-    csv_queue.put(csv_row)
-    # print(f"【写入】子文件夹 {subfolder_name} 的结果已加入写入队列")
 
-    return subfolder_name, subfolder_results, total_time
+SINK_CLASSES = {
+    "csv": CsvSink,
+    "detail": DetailCsvSink,
+    "jsonl": JsonlSink,
+    "sqlite": SqliteSink,
+}
 
 
-def csv_writer_worker(csv_filename, csv_queue):
+def result_writer_worker(
+    sinks, result_queue, flush_interval=1.0, flush_rows=100, errors=None
+):
     """
-    CSV写入工作线程，负责异步写入数据
+    结果写入工作线程：从队列取出子文件夹记录写入所有输出，批量刷新到磁盘
+
+    每个输出保持一个打开的文件句柄；距上次刷新超过 flush_interval 秒或积攒
+    flush_rows 条记录时刷新一次。队列中的记录为字典：
+    {"subfolder", "row"（CSV 汇总行）, "results"（各任务详细结果）, "cached"（可选）}，
+    cached 为 True 的记录来自结果缓存，只写入尚未包含该子文件夹的输出。
 
     参数:
-        csv_filename: CSV文件路径
-        csv_queue: 写入数据队列
+        sinks: 输出列表（CsvSink / DetailCsvSink / JsonlSink / SqliteSink）
+        result_queue: 写入数据队列，收到 None 时刷新并退出
+        flush_interval: 刷新间隔（秒）
+        flush_rows: 刷新前最多积攒的记录数
+        errors: 写入异常列表；出错时记录异常并停止写入（不终止进程，常驻服务中
+                只有当前任务失败），由调用方检查；默认为None直接抛出
     """
-    max_retries = 3
-    retry_delay = 0.1
+    pending = []
+    last_flush = time.monotonic()
+
+    def flush():
+        nonlocal last_flush
+        for sink in sinks:
+            sink.flush()
+        for name in pending:
+            print(f"【写入】数据已写入结果文件: {name}")
+        pending.clear()
+        last_flush = time.monotonic()
 
-    while True:
-        try:
-            # 从队列获取数据，如果队列为空则阻塞等待
-            csv_row = csv_queue.get(timeout=1)
+    try:
+        while True:
+            try:
+                record = result_queue.get(timeout=flush_interval)
+            except queue.Empty:
+                record = False  # 超时，检查是否需要刷新
 
             # 检查是否为结束信号
-            if csv_row is None:
+            if record is None:
                 break
 
-            # 重试写入
-            for attempt in range(max_retries + 1):
-                try:
-                    with open(csv_filename, "a", newline="", encoding="utf-8-sig") as f:
-                        csv.writer(f).writerow(csv_row)
-                    print(f"【写入】数据已写入CSV: {csv_row[0]}")
-                    break
-                except PermissionError as e:
-                    if attempt < max_retries:
-                        print(
-                            f"【写入】写入CSV权限错误（重试 {attempt+1}/{max_retries}）"
-                        )
-                        time.sleep(retry_delay * (attempt + 1))
-                    else:
-                        print(f"⛔ 【错误】CSV写入失败，程序终止: {str(e)}")
-                        os._exit(1)  # 直接终止程序
-                except Exception as e:
-                    print(f"⛔ 【错误】CSV写入异常，程序终止: {str(e)}")
-                    os._exit(1)  # 直接终止程序
+            if record:
+                written = False
+                for sink in sinks:
+                    if record.get("cached") and record["subfolder"] in sink.written:
+                        continue
+                    sink.write(record)
+                    sink.written.add(record["subfolder"])
+                    written = True
+                if written:
+                    pending.append(record["subfolder"])
+
+            if pending and (
+                len(pending) >= flush_rows
+                or time.monotonic() - last_flush >= flush_interval
+            ):
+                flush()
+        flush()
+    except Exception as e:
+        print(f"⛔ 【错误】结果写入异常，停止写入: {str(e)}")
+        if errors is None:
+            raise
+        errors.append(e)
 
-            csv_queue.task_done()
 
-        except queue.Empty:
-            # 队列为空，继续等待
-            continue
-        except Exception as e:
-            print(f"⛔ 【错误】写入线程异常，程序终止: {str(e)}")
-            os._exit(1)  # 直接终止程序
+def _subfolder_size(subfolder):
+    """
+    估计子文件夹的帧数（图片文件数，视频文件取元数据中的帧数），用于调度排序
+
+    返回:
+        帧数，无法读取时为 0
+    """
+    if os.path.isfile(subfolder):
+        cap = cv2.VideoCapture(subfolder)
+        try:
+            return max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        finally:
+            cap.release()
+    try:
+        return sum(
+            1
+            for entry in os.scandir(subfolder)
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    except OSError:
+        return 0
+
+
+class SubfolderWatcher:
+    """
+    监视总文件夹，找出录制完成的新子文件夹（及视频文件）
 
+    设置 marker 时，子文件夹内出现该标记文件即视为录制完成；否则图片数与最新
+    修改时间连续 stable 次扫描不变视为完成。视频文件始终按大小与修改时间判断。
+    首次扫描时，最新修改时间距今已超过 stable 个扫描间隔的子文件夹直接视为完成，
+    启动前已录制好的数据无需等待。
+    每个子文件夹只返回一次，之后新增的帧不会触发重新处理。
+
+    参数:
+        parent_folder: 总文件夹路径
+        stable: 连续不变的扫描次数
+        marker: 录制完成标记文件名，空表示按图片数判断
+        interval: 扫描间隔（秒），用于首次扫描判断；0 表示首次扫描同样逐次判断
+    """
 
-def gate_multi_thread(parent_folder, tasks, task_headers, max_threads, debug=False):
+    def __init__(self, parent_folder, stable=2, marker="", interval=0):
+        self.parent_folder = parent_folder
+        self.stable = stable
+        self.marker = marker
+        self.quiet_ns = int(stable * interval * 1e9)  # 首次扫描视为完成的静止时长
+        self.seen = set()  # 已返回的子文件夹
+        self._states = {}  # 子文件夹 -> (签名, 连续不变次数)
+        self._scanned = False  # 是否已扫描过
+
+    @staticmethod
+    def _signature(path, is_video):
+        """子文件夹为 (图片数, 最新修改时间)，视频文件为 (大小, 修改时间)"""
+        if is_video:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns
+        count, newest = 0, 0
+        for entry in os.scandir(path):
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                count += 1
+                newest = max(newest, entry.stat().st_mtime_ns)
+        return count, newest
+
+    def scan(self):
+        """
+        扫描一次总文件夹
+
+        返回:
+            本次判定为录制完成的子文件夹路径列表
+        """
+        ready = []
+        startup = not self._scanned and self.quiet_ns > 0
+        self._scanned = True
+        now = time.time_ns()
+        for entry in os.scandir(self.parent_folder):
+            if entry.path in self.seen:
+                continue
+            is_video = entry.is_file() and entry.name.lower().endswith(VIDEO_EXTENSIONS)
+            if not (entry.is_dir() or is_video):
+                continue
+            try:
+                if self.marker and not is_video:
+                    done = os.path.exists(os.path.join(entry.path, self.marker))
+                else:
+                    signature = self._signature(entry.path, is_video)
+                    previous, count = self._states.get(entry.path, (None, 0))
+                    count = count + 1 if signature == previous else 0
+                    self._states[entry.path] = (signature, count)
+                    quiet = startup and now - signature[1] >= self.quiet_ns
+                    done = signature[0] > 0 and (count >= self.stable or quiet)
+            except OSError:
+                continue  # 扫描时被移动或删除
+            if done:
+                self.seen.add(entry.path)
+                self._states.pop(entry.path, None)
+                ready.append(entry.path)
+        return ready
+
+
+def gate_multi_thread(
+    parent_folder,
+    tasks,
+    task_headers,
+    max_threads,
+    debug=False,
+    options=None,
+    serve=False,
+    workers=None,
+):
     """
     使用多线程处理总文件夹内所有子文件夹
 
+    监视模式（options["watch"]）下不在处理完后退出，而是定期扫描总文件夹，
+    录制完成的新子文件夹立即提交到同一个线程池/进程池，结果逐个追加写入，
+    直到 Ctrl+C 后等待处理中的子文件夹完成再退出。
+
     参数:
         parent_folder: 总文件夹路径
         tasks: 任务参数列表
         task_headers: CSV表头列表
         max_threads: 最大线程数
         debug: Debug模式开关
+        options: 全局选项字典（见 GLOBAL_OPTIONS），默认为None使用默认值
+        serve: 是否由常驻服务调用；多个任务同时运行，不重置进程全局的追踪、
+              实时指标与解码帧内存预算（由 JobServer 启动时统一配置）
+        workers: 处理子文件夹的线程池（线程池模式），默认为None表示新建、处理完关闭；
+              提供时直接使用且不关闭（JobServer 所有任务共享），忽略 max_threads
 
     返回:
         处理结果列表
     """
     start_total = time.time()
 
-    # 准备CSV文件
-    csv_header = ["子文件夹名"] + task_headers
-    csv_filename = os.path.normpath(os.path.join(parent_folder, "处理结果.csv"))
-
-    # 如果文件不存在，创建并写入表头
-    if not os.path.exists(csv_filename):
-        with open(csv_filename, "w", newline="", encoding="utf-8-sig") as f:
-            csv.writer(f).writerow(csv_header)
+    options = {**GLOBAL_OPTIONS, **(options or {})}
 
-    # 获取所有子文件夹
-    subfolders = [f.path for f in os.scandir(parent_folder) if f.is_dir()]
+    # 打开结果输出（新文件写入表头），记录各输出已包含的子文件夹
+    csv_filename = os.path.normpath(os.path.join(parent_folder, "处理结果.csv"))
+    sinks = []
+    try:
+        for name in options["sinks"]:
+            sinks.append(SINK_CLASSES[name](parent_folder, task_headers))
+    except Exception:
+        for sink in sinks:
+            sink.close()
+        raise
+
+    # 获取所有子文件夹（及视频文件），监视模式下只取录制完成的子文件夹
+    watcher = None
+    if options["watch"]:
+        watcher = SubfolderWatcher(
+            parent_folder,
+            options["watch_stable"],
+            options["watch_marker"],
+            options["watch_interval"],
+        )
+        subfolders = watcher.scan()
+    else:
+        subfolders = [
+            f.path
+            for f in os.scandir(parent_folder)
+            if f.is_dir() or (f.is_file() and f.name.lower().endswith(VIDEO_EXTENSIONS))
+        ]
 
     # 创建写入队列和启动写入线程
-    csv_queue = queue.Queue()
+    # 进程池模式使用 Manager 队列，子进程结果实时回传到本进程的写入线程
+    use_process = options["executor"] == "process"
+    if not serve:
+        tracer.enabled = bool(options["trace"])
+    manager = multiprocessing.Manager() if use_process else None
+    csv_queue = manager.Queue() if use_process else queue.Queue()
+
+    # 匹配位置先验，进程池模式下由 Manager 在进程间共享
+    prior = None
+    if options["prior"]:
+        if use_process:
+            prior = OffsetPrior(manager.dict(), manager.Lock())
+        else:
+            prior = OffsetPrior()
+    write_errors = []  # 写入线程出错时记录异常，处理结束后抛出
     writer_thread = threading.Thread(
-        target=csv_writer_worker, args=(csv_filename, csv_queue), daemon=True
+        target=result_writer_worker,
+        args=(sinks, csv_queue, options["sink_flush_interval"], 100, write_errors),
+        daemon=True,
     )
     writer_thread.start()
 
+    # 结果缓存：跳过未变化的子文件夹，缺失的 CSV 行从缓存补写
+    results = []
+    result_cache = None
+    fingerprints = {}
+    if options["result_cache"]:
+        result_cache = ResultCache(
+            os.path.normpath(os.path.join(parent_folder, "处理缓存.sqlite"))
+        )
+        if options["force"]:
+            result_cache.clear()
+            print("【缓存】已清空结果缓存，重新处理所有子文件夹")
+        config_hash = _config_hash(tasks, options)
+
+    def admit(batch):
+        """查询结果缓存并按调度顺序排序，返回需要处理的子文件夹"""
+        if result_cache is not None:
+            pending = []
+            for subfolder in batch:
+                subfolder_name = os.path.basename(subfolder)
+                fingerprint = _subfolder_fingerprint(subfolder)
+                cached = result_cache.lookup(subfolder_name, fingerprint, config_hash)
+                if cached is None:
+                    fingerprints[subfolder] = fingerprint
+                    pending.append(subfolder)
+                    continue
+                results.append((subfolder_name, cached))
+                csv_queue.put(
+                    {
+                        "subfolder": subfolder_name,
+                        "row": _csv_row_from_results(
+                            subfolder_name, cached, len(tasks)
+                        ),
+                        "results": cached,
+                        "cached": True,
+                    }
+                )
+            if len(pending) < len(batch):
+                print(
+                    f"【缓存】{len(batch) - len(pending)} 个子文件夹未变化，沿用上次结果（--force 重新处理）"
+                )
+            batch = pending
+
+        # 帧数多的子文件夹优先提交，避免最大的子文件夹最后开始、拖长总耗时
+        if options["schedule"] == "size":
+            sizes = {subfolder: _subfolder_size(subfolder) for subfolder in batch}
+            batch.sort(key=lambda subfolder: sizes[subfolder], reverse=True)
+            if debug and batch:
+                print(
+                    f"ℹ️ 【调试：调度】按帧数从多到少提交，最大 {sizes[batch[0]]} 帧，最小 {sizes[batch[-1]]} 帧"
+                )
+        return batch
+
+    subfolders = admit(subfolders)
+
     # Debug模式强制单线程
     if debug:
         max_threads = 1
         print(f"ℹ️ 【调试模式】已启用！激活调试日志，强制单线程")
 
+    # 解码帧内存预算：线程池模式全局共享，进程池模式按进程数平分
+    if not serve:
+        memory_budget.configure(options["max_memory_mb"])
+    process_memory = {}  # 进程池模式：进程号 -> 该进程的内存预算统计
+
+    # 实时指标，进程池模式下子进程增量经由 Manager 队列送回
+    reporter = None
+    reporter_enabled = bool(options["metrics_port"] or options["metrics_file"])
+    if not serve:
+        metrics.reset()
+        metrics.enabled = reporter_enabled
+    metrics_sink = manager.Queue() if reporter_enabled and use_process else None
+
     # 使用线程池执行任务
-    results = []
     print(f"🌾 Perf Garden 已就绪…… 请坐和放宽！")
-    print(f"开始多线程处理，最大线程数: {max_threads}")
+    if use_process:
+        print(f"开始多进程处理，最大进程数: {max_threads}")
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_threads,
+            initializer=_init_process_worker,
+            initargs=(tasks, metrics_sink, options["max_memory_mb"] / max_threads),
+        )
+    elif workers is not None:
+        print("开始多线程处理，使用服务共享的线程池")
+        pool = contextlib.nullcontext(workers)
+    else:
+        print(f"开始多线程处理，最大线程数: {max_threads}")
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads)
+
+    if reporter_enabled:
+        metrics.set("perfgarden_subfolders_total", len(subfolders))
+        metrics.set("perfgarden_subfolders_pending", len(subfolders))
+        reporter = MetricsReporter(
+            options["metrics_interval"],
+            max_threads,
+            csv_queue,
+            options["metrics_file"],
+            options["metrics_port"],
+            metrics_sink,
+        )
+
+    with pool as executor:
+
+        def submit(subfolder):
+            """提交单个子文件夹"""
+            if use_process:
+                return executor.submit(
+                    _process_subfolder_worker,
+                    subfolder,
+                    csv_filename,
+                    csv_queue,
+                    debug,
+                    options,
+                    prior,
+                )
+            return executor.submit(
+                process_subfolder,
+                subfolder,
+                tasks,
+                csv_filename,
+                csv_queue,
+                debug,
+                options,
+                prior,
+            )
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
         # 创建任务
-        future_to_subfolder = {
-            executor.submit(
-                process_subfolder, subfolder, tasks, csv_filename, csv_queue, debug
-            ): subfolder
-            for subfolder in subfolders
-        }
+        future_to_subfolder = {submit(subfolder): subfolder for subfolder in subfolders}
+        if watcher is not None:
+            print(
+                f"【监视】正在监视总文件夹，每 {options['watch_interval']} 秒扫描一次新子文件夹（Ctrl+C 退出）"
+            )
+            next_scan = time.monotonic() + options["watch_interval"]
+
+        # 监视模式：Ctrl+C 只记录中断，由主循环停止监视并等待处理中的子文件夹完成，
+        # 再次 Ctrl+C 不中断等待与收尾（进程池子进程忽略 SIGINT，见 _init_process_worker）
+        interrupts = []
+        notified = 0
+        previous_handler = None
+        if (
+            watcher is not None
+            and threading.current_thread() is threading.main_thread()
+        ):
+            previous_handler = signal.signal(
+                signal.SIGINT, lambda signum, frame: interrupts.append(signum)
+            )
 
-        # 收集结果
-        for future in concurrent.futures.as_completed(future_to_subfolder):
-            subfolder = os.path.basename(future_to_subfolder[future])
-            try:
-                subfolder_name, subfolder_results, subfolder_time = future.result()
-                results.append((subfolder_name, subfolder_results))
-                print(
-                    f"✅ 【完成】子文件夹 {subfolder_name} 处理完成，耗时: {subfolder_time:.2f}秒"
-                )
-            except Exception as e:
-                print(f"⛔ 【错误】子文件夹 {subfolder} 处理出错: {e}")
+        # 收集结果；监视模式下到时扫描总文件夹，录制完成的新子文件夹立即提交
+        try:
+            while future_to_subfolder or watcher is not None:
+                if write_errors:
+                    # 写入线程已出错：取消尚未开始的子文件夹，停止监视
+                    for future in future_to_subfolder:
+                        future.cancel()
+                    break
+                if len(interrupts) > notified:
+                    notified = len(interrupts)
+                    if watcher is not None:
+                        watcher = None
+                        print(
+                            f"【监视】已停止监视，等待 {len(future_to_subfolder)} 个处理中的子文件夹完成……"
+                        )
+                    else:
+                        print(
+                            f"【监视】仍在等待 {len(future_to_subfolder)} 个处理中的子文件夹完成，请稍候……"
+                        )
+                    continue
+                timeout = None
+                if watcher is not None:
+                    timeout = max(0, next_scan - time.monotonic())
+                elif previous_handler is not None:
+                    timeout = options["watch_interval"]  # 定期检查是否再次 Ctrl+C
+                if future_to_subfolder:
+                    done, _ = concurrent.futures.wait(
+                        future_to_subfolder,
+                        timeout,
+                        concurrent.futures.FIRST_COMPLETED,
+                    )
+                else:
+                    time.sleep(timeout)
+                    done = ()
+                if watcher is not None and time.monotonic() >= next_scan:
+                    next_scan = time.monotonic() + options["watch_interval"]
+                    batch = admit(watcher.scan())
+                    if batch:
+                        print(f"【监视】发现 {len(batch)} 个录制完成的新子文件夹")
+                        metrics.inc("perfgarden_subfolders_total", len(batch))
+                        metrics.inc("perfgarden_subfolders_pending", len(batch))
+                        for subfolder in batch:
+                            future_to_subfolder[submit(subfolder)] = subfolder
+
+                for future in done:
+                    subfolder_path = future_to_subfolder.pop(future)
+                    subfolder = os.path.basename(subfolder_path)
+                    try:
+                        outcome = future.result()
+                        subfolder_name, subfolder_results, subfolder_time = outcome[:3]
+                        if use_process:
+                            tracer.extend(outcome[3])
+                            pid, memory_stats = outcome[4]
+                            process_memory[pid] = memory_stats
+                        results.append((subfolder_name, subfolder_results))
+                        if result_cache is not None:
+                            result_cache.store(
+                                subfolder_name,
+                                fingerprints.pop(subfolder_path),
+                                config_hash,
+                                subfolder_results,
+                            )
+                        metrics.inc("perfgarden_subfolders_done_total")
+                        print(
+                            f"✅ 【完成】子文件夹 {subfolder_name} 处理完成，耗时: {subfolder_time:.2f}秒"
+                        )
+                    except Exception as e:
+                        metrics.inc("perfgarden_subfolders_failed_total")
+                        print(f"⛔ 【错误】子文件夹 {subfolder} 处理出错: {e}")
+                    metrics.inc("perfgarden_subfolders_pending", -1)
+        except KeyboardInterrupt:
+            # 非监视模式：取消尚未开始的子文件夹，只等待处理中的子文件夹
+            for future in future_to_subfolder:
+                future.cancel()
+            raise
+        except Exception:
+            if previous_handler is not None:
+                signal.signal(signal.SIGINT, previous_handler)
+            raise
+
+    if prior is not None:
+        for task_idx, (offset, count) in sorted(prior.summary().items()):
+            print(
+                f"【先验】{task_headers[task_idx]}: 期望位置 {offset}（{count} 个子文件夹）"
+            )
 
     # 等待所有写入任务完成
     csv_queue.put(None)  # 发送结束信号
     writer_thread.join()  # 等待写入线程结束
+    for sink in sinks:
+        sink.close()
+    if reporter is not None:
+        reporter.close()
+        metrics.enabled = False
+    if manager is not None:
+        manager.shutdown()
+    if result_cache is not None:
+        result_cache.close()
+    if previous_handler is not None:
+        signal.signal(signal.SIGINT, previous_handler)  # 收尾完成后恢复 Ctrl+C
+    if write_errors:
+        raise RuntimeError(
+            f"⛔ 【错误】结果写入失败: {str(write_errors[0])}"
+        ) from write_errors[0]
+
+    # 解码帧内存峰值（进程池模式为各进程峰值之和，即整体峰值的上限）；
+    # 服务模式下所有任务共享内存预算，统计见 /health
+    if not serve:
+        if use_process:
+            memory_stats = {
+                key: sum(stats[key] for stats in process_memory.values())
+                for key in ("peak_mb", "waits", "wait_seconds", "overcommits")
+            }
+            memory_stats["limit_mb"] = round(float(options["max_memory_mb"]), 1)
+        else:
+            memory_stats = memory_budget.stats()
+        if memory_stats["limit_mb"]:
+            print(
+                f"【内存】解码帧峰值 {memory_stats['peak_mb']:.1f} MB（上限 {memory_stats['limit_mb']} MB），解码等待 {memory_stats['waits']} 次共 {memory_stats['wait_seconds']:.2f}秒，超时后超额解码 {memory_stats['overcommits']} 次"
+            )
+        else:
+            print(f"【内存】解码帧峰值 {memory_stats['peak_mb']:.1f} MB（未设置上限）")
+
+    if tracer.enabled:
+        trace_path = os.path.abspath(options["trace"])
+        event_count = tracer.export(trace_path)
+        tracer.enabled = False
+        print(f"【追踪】已导出 {event_count} 条追踪事件: {trace_path}")
 
     # ========== 统计 PASS 和非 PASS 的子文件夹 ==========
     pass_folders = []
@@ -857,8 +4104,16 @@ def gate_multi_thread(parent_folder, tasks, task_headers, max_threads, debug=Fal
             non_pass_folders.append(subfolder_name)
 
     total_time = time.time() - start_total
+
+    if debug and not use_process:
+        cache_stats = template_cache.stats()
+        print(
+            f"ℹ️ 【调试：模板缓存】命中 {cache_stats['hits']} 次 | 未命中 {cache_stats['misses']} 次 | 缓存 {cache_stats['size']} 个模板"
+        )
+
     print(f"🌾 所有任务完成！用时: {total_time:.2f}秒，Have A Nice Day~ 🌾🌾🌾🌾🌾🌾")
-    print(f"结果已保存到: {csv_filename}")
+    for sink in sinks:
+        print(f"结果已保存到: {sink.path}")
 
     # 输出统计信息
     print(f"📊 ========== 处理结果统计 ==========")
@@ -875,6 +4130,285 @@ def gate_multi_thread(parent_folder, tasks, task_headers, max_threads, debug=Fal
     return results
 
 
+# ========== 服务模式：常驻进程，通过本机 HTTP 或 Unix 套接字接收、排队、并发执行任务 ==========
+def _is_socket(path):
+    """判断路径是否为套接字文件（不存在时返回False）"""
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _job_folder(spec):
+    """返回任务的总文件夹（任务指定的 path，否则读取 YAML 中的 path），读取失败时返回None"""
+    if spec.get("path"):
+        return os.path.normpath(spec["path"])
+    try:
+        with open(spec["yaml"], "r", encoding="utf-8") as file:
+            config = yaml.safe_load(file)
+        for item in config:
+            if isinstance(item, dict) and "path" in item:
+                return os.path.normpath(item["path"])
+    except Exception:
+        pass
+    return None
+
+
+class JobServer:
+    """
+    常驻任务服务：进程、OpenCV 与已预处理的模板在任务之间保持加载
+
+    接口（JSON）:
+        POST /jobs          提交任务 {"yaml": 配置路径, "path": 总文件夹（可选）,
+                            "force": 是否忽略结果缓存（可选）}，返回 202 {"id", "status"}
+        GET  /jobs          所有任务的状态列表
+        GET  /jobs/<id>     单个任务的状态，完成后含各子文件夹结果
+        GET  /health        服务状态（排队、运行中的任务数，解码帧内存统计）
+
+    任务状态依次为 queued（排队）、running（运行中）、done（完成）或 failed（出错）。
+    超过 jobs 个任务时排队等待；处理同一总文件夹的任务依次执行（结果文件与缓存
+    按总文件夹存放）；只保留最近 history 个已结束任务的结果。
+    服务模式只支持线程池（executor: process 被忽略）：进程池须为每个任务的配置
+    重新创建子进程，无法在任务之间保持预热。所有任务的子文件夹在同一个常驻
+    线程池中处理（max_threads 个线程）；结果文件与写入线程仍按任务打开、关闭。
+
+    参数:
+        port: 本机 HTTP 端口（只监听 127.0.0.1），socket_path 提供时忽略
+        socket_path: Unix 套接字路径，默认为None使用 HTTP 端口
+        jobs: 同时运行的任务数
+        max_threads: 处理子文件夹的共享线程数，None 时使用CPU核心数
+        debug: Debug模式开关
+        history: 保留的已结束任务数
+        max_memory_mb: 所有任务解码帧的内存上限（MB），0 表示不限制；追踪、实时指标与
+                       内存预算为进程全局状态，服务启动时配置一次，任务 YAML 中的
+                       max_memory_mb 被忽略
+    """
+
+    def __init__(
+        self,
+        port=8765,
+        socket_path=None,
+        jobs=2,
+        max_threads=None,
+        debug=False,
+        history=1000,
+        max_memory_mb=0,
+    ):
+        tracer.enabled = False
+        metrics.enabled = False
+        memory_budget.configure(max_memory_mb)
+        self.max_threads = max_threads
+        self.debug = debug
+        self.history = history
+        self.jobs = OrderedDict()  # 任务号 -> 任务状态字典
+        self._next_id = 1
+        self._lock = threading.Lock()
+        # 总文件夹 -> [锁, 运行或等待中的任务数]，没有任务时删除
+        self._folder_locks = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, jobs), thread_name_prefix="job"
+        )
+        # 子文件夹线程池，所有任务共享（Debug模式强制单线程）
+        self._workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1 if debug else max_threads or os.cpu_count() or 8,
+            thread_name_prefix="subfolder",
+        )
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = self.path.split("?")[0].rstrip("/")
+                if route == "/health":
+                    self._reply(200, server.health())
+                elif route == "/jobs":
+                    self._reply(200, {"jobs": server.list_jobs()})
+                elif route.startswith("/jobs/"):
+                    job = server.get_job(route[len("/jobs/") :])
+                    if job is None:
+                        self._reply(404, {"error": "任务不存在"})
+                    else:
+                        self._reply(200, job)
+                else:
+                    self._reply(404, {"error": "未知路径"})
+
+            def do_POST(self):
+                if self.path.split("?")[0].rstrip("/") != "/jobs":
+                    self._reply(404, {"error": "未知路径"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    spec = json.loads(self.rfile.read(length) or b"{}")
+                    job = server.submit(spec)
+                except (ValueError, TypeError) as e:
+                    self._reply(400, {"error": str(e)})
+                    return
+                self._reply(202, job)
+
+            def _reply(self, code, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def address_string(self):
+                return str(self.client_address[0]) if self.client_address else "unix"
+
+            def log_message(self, *args):
+                pass  # 不输出访问日志
+
+        if socket_path:
+            if not hasattr(socketserver, "UnixStreamServer"):
+                raise RuntimeError(
+                    "⛔ 【错误】当前系统不支持 Unix 套接字，请改用 --port"
+                )
+            if os.path.exists(socket_path):
+                if not _is_socket(socket_path):
+                    raise FileExistsError(
+                        f"⛔ 【错误】--socket 路径已存在且不是套接字，拒绝启动: {socket_path}"
+                    )
+                os.remove(socket_path)  # 上次异常退出遗留的套接字文件
+
+            class UnixHTTPServer(
+                socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+            ):
+                daemon_threads = True
+
+            self.server = UnixHTTPServer(socket_path, Handler)
+            self.address = f"unix://{socket_path}"
+        else:
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            self.address = f"http://127.0.0.1:{port}"
+        self.socket_path = socket_path
+
+    def submit(self, spec):
+        """
+        提交任务
+
+        参数:
+            spec: 任务描述字典，见类说明
+
+        返回:
+            {"id", "status"}，任务描述无效时抛出 ValueError
+        """
+        if not isinstance(spec, dict) or not isinstance(spec.get("yaml"), str):
+            raise ValueError("任务须为 JSON 对象，并以 yaml 字段指定配置文件路径")
+        if not os.path.exists(spec["yaml"]):
+            raise ValueError(f"YAML配置文件不存在: {spec['yaml']}")
+
+        with self._lock:
+            job_id = str(self._next_id)
+            self._next_id += 1
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "yaml": spec["yaml"],
+                "path": spec.get("path"),
+                "submitted": time.time(),
+            }
+            self._trim()
+        self._pool.submit(self._run, job_id, spec)
+        print(f"【服务】已接收任务 {job_id}: {spec['yaml']}")
+        return {"id": job_id, "status": "queued"}
+
+    def _run(self, job_id, spec):
+        """在任务线程中执行单个任务，同一总文件夹的任务依次执行"""
+        folder = _job_folder(spec)
+        with self._lock:
+            entry = self._folder_locks.setdefault(folder, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                self._execute(job_id, spec)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._folder_locks[folder]
+
+    def _execute(self, job_id, spec):
+        job = self.jobs[job_id]
+        with self._lock:
+            job.update(status="running", started=time.time())
+        stale = template_cache.refresh()
+        if stale and self.debug:
+            print(f"ℹ️ 【调试：服务】模板文件已变化，重新加载 {stale} 个模板")
+        try:
+            results = gate_from_yaml(
+                spec["yaml"],
+                max_threads=self.max_threads,
+                path=spec.get("path"),
+                debug=self.debug,
+                force=bool(spec.get("force", False)),
+                serve=True,
+                workers=self._workers,
+            )
+            outcome = {
+                "status": "done",
+                "results": [
+                    {"subfolder": name, "tasks": subfolder_results}
+                    for name, subfolder_results in results
+                ],
+            }
+        except Exception as e:
+            outcome = {"status": "failed", "error": str(e)}
+        with self._lock:
+            job.update(outcome, finished=time.time())
+        print(f"【服务】任务 {job_id} 已结束，状态 {outcome['status']}")
+
+    def _trim(self):
+        """只保留最近 history 个已结束任务（调用方持有锁）"""
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job["status"] in ("done", "failed")
+        ]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def get_job(self, job_id):
+        """返回任务状态（含结果）的副本，不存在时返回None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        """返回所有任务的状态（不含结果）"""
+        with self._lock:
+            return [
+                {key: value for key, value in job.items() if key != "results"}
+                for job in self.jobs.values()
+            ]
+
+    def health(self):
+        """返回服务状态"""
+        with self._lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {
+            "status": "ok",
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "templates": template_cache.stats()["size"],
+            "memory": memory_budget.stats(),
+        }
+
+    def serve_forever(self):
+        """在当前线程中提供服务，Ctrl+C 后等待运行中的任务结束再退出"""
+        print(f"🌾 Perf Garden 服务已启动: {self.address}（Ctrl+C 退出）")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print("【服务】正在退出，等待运行中的任务结束……")
+        finally:
+            self.server.server_close()
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._workers.shutdown(wait=True)
+            if self.socket_path and _is_socket(self.socket_path):
+                os.remove(self.socket_path)
+
+
 # 使用示例
 if __name__ == "__main__":
     # ========== 硬编码配置（方便调试）==========
@@ -882,25 +4416,84 @@ if __name__ == "__main__":
     DEBUG = True  # Debug 模式
 
     # ========== 命令行参数解析 ==========
-    # 使用示例: python PerfGarden.py --yaml_path "config.yaml" --path "D:\images" --max_threads 8 --debug
+    # 使用示例: python PerfGarden.py --yaml_path "config.yaml" --path "D:\images" --max_threads 8 --executor process --force --trace "trace.json" --debug
+    # 监视模式: python PerfGarden.py --yaml_path "config.yaml" --watch
+    # 服务模式: python PerfGarden.py serve --port 8765 --jobs 2
     parser = argparse.ArgumentParser(description="Perf Garden - 智能性能分帧打标")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        choices=["run", "serve"],
+        default="run",
+        help="run 处理一次后退出（默认）/ serve 常驻服务，通过本机 HTTP 或 Unix 套接字接收任务",
+    )
     parser.add_argument("--yaml_path", type=str, help="YAML配置文件路径")
     parser.add_argument("--path", type=str, help="总文件夹路径")
     parser.add_argument("--max_threads", type=int, help="最大线程数")
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        help="并行方式：thread 线程池（默认）/ process 进程池（绕过GIL，适合多核）",
+    )
     parser.add_argument(
         "--debug", action="store_true", help="启用Debug模式（激活调试日志，强制单线程）"
     )
+    parser.add_argument(
+        "--force", action="store_true", help="忽略结果缓存，重新处理所有子文件夹"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="逐帧追踪输出文件（.json 为 Chrome trace，.jsonl 为逐行事件）",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="持续监视总文件夹，录制完成的新子文件夹立即处理（Ctrl+C 退出）",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="服务模式：本机 HTTP 端口"
+    )
+    parser.add_argument(
+        "--socket", type=str, help="服务模式：Unix 套接字路径（指定时不监听 HTTP 端口）"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=2, help="服务模式：同时运行的任务数"
+    )
+    parser.add_argument(
+        "--max_memory_mb",
+        type=float,
+        default=0,
+        help="服务模式：所有任务解码帧的内存上限（MB），0 表示不限制",
+    )
     args = parser.parse_args()
 
-    # yaml_path 和 debug: 命令行 > 硬编码
-    # path 和 max_threads: 命令行 > YAML配置（在gate_from_yaml中处理）
-    final_yaml_path = args.yaml_path or YAML_PATH
-    final_debug = args.debug or DEBUG
-
-    # 执行主函数
-    results = gate_from_yaml(
-        yaml_path=final_yaml_path,
-        max_threads=args.max_threads,
-        path=args.path,
-        debug=final_debug,
-    )
+    # 服务模式：不使用硬编码的 DEBUG（调试模式强制单线程）
+    if args.mode == "serve":
+        if args.executor == "process":
+            print("🟠 【警告】服务模式只支持线程池，已忽略 --executor process")
+        JobServer(
+            port=args.port,
+            socket_path=args.socket,
+            jobs=args.jobs,
+            max_threads=args.max_threads,
+            debug=args.debug,
+            max_memory_mb=args.max_memory_mb,
+        ).serve_forever()
+    else:
+        # yaml_path 和 debug: 命令行 > 硬编码
+        # path、max_threads 和 executor: 命令行 > YAML配置（在gate_from_yaml中处理）
+        final_yaml_path = args.yaml_path or YAML_PATH
+        final_debug = args.debug or DEBUG
+
+        # 执行主函数
+        results = gate_from_yaml(
+            yaml_path=final_yaml_path,
+            max_threads=args.max_threads,
+            path=args.path,
+            debug=final_debug,
+            executor=args.executor,
+            force=args.force,
+            trace=args.trace,
+            watch=args.watch,
+        )